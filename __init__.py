@@ -9,7 +9,7 @@ bl_info = {
 	"category" : "Import-Export"
 }
 import importlib
-import requests, json, webbrowser, tarfile
+import requests, webbrowser
 if "bpy" in locals():
 	if "ipfsvr_export" in locals():
 		importlib.reload(ipfsvr_export)
@@ -51,7 +51,7 @@ import bpy
 
 import bpy.utils.previews
 
-from . import vr_export, vr_import
+from . import vr_export, vr_import, ipfs, vesta, preview, steps
 
 Scene.roomhash = StringProperty(name="", default="")
 
@@ -76,6 +76,11 @@ Scene.janus_ipfs = BoolProperty(name="Use IPFS", default=False)
 Scene.janus_gateway = BoolProperty(name="IPFS Gateway", default=False)
 Scene.janus_ipns = BoolProperty(name="IPNS", default=False)
 Scene.janus_ipnsname = StringProperty(name="", default="myroom")
+Scene.janus_ipfs_incremental = BoolProperty(name="Incremental Publish", description="Only send files to IPFS that no earlier publish from this export path already added. On by default, turn off to add every file again like before", default=True)
+Scene.janus_ipfs_car = BoolProperty(name="Write CAR Archive", description="Also write the exported room as a .car next to its directory, to import into any IPFS node later", default=False)
+
+Scene.janus_gzip_level = IntProperty(name="Compression Level", description="gzip level for exported meshes and uploaded archives", default=9, min=1, max=9)
+Scene.janus_gzip_threads = IntProperty(name="Compression Threads", description="Threads compressing each file (0 uses all cores)", default=0, min=0, max=64)
 
 Scene.janus_apply_rot = BoolProperty(name="Apply Rotation", default=False)
 Scene.janus_apply_scale = BoolProperty(name="Apply Scale", default=False)
@@ -101,6 +106,15 @@ class VestaSettingsPanel(Panel):
 		self.vestatoken = getv(bpy.context, "vestatoken") or ''
 		col.prop(preferences().addons[__name__].preferences, "vestatoken")
 		self.layout.operator("export_scene.vesta")
+		exportpath = getv(context, "exportpath")
+		if exportpath:
+			vesta.uploader.load(os.path.join(exportpath, vesta.queue_name))
+		if vesta.uploader.running():
+			self.layout.label(text="Uploading: %s" % vesta.uploader.state)
+			self.layout.operator("export_scene.vesta_stop")
+		elif vesta.uploader.waiting():
+			self.layout.label(text=vesta.uploader.state)
+			self.layout.operator("export_scene.vesta_resume")
 
 class ExportSettingsPanel(Panel):
 	bl_label = "Export Settings"
@@ -112,10 +126,20 @@ class ExportSettingsPanel(Panel):
 		self.layout.operator("export_path.html")
 		self.layout.prop(context.scene, "janus_ipfs")
 		if context.scene.janus_ipfs:
+			self.layout.label(text="IPFS daemon: %s" % ipfs.manager.state)
+			if not ipfs.manager.ready.is_set():
+				self.layout.operator("export_scene.ipfs_daemon")
 			self.layout.prop(context.scene, "janus_gateway")
+			self.layout.prop(context.scene, "janus_ipfs_incremental")
+			self.layout.prop(context.scene, "janus_ipfs_car")
 			self.layout.prop(context.scene, "janus_ipns")
 		if context.scene.janus_ipns:
 			self.layout.prop(context.scene, "janus_ipnsname")
+			self.layout.label(text="IPNS: %s" % ipfs.publisher.state)
+			if ipfs.publisher.name:
+				self.layout.label(text="/ipns/%s" % ipfs.publisher.name)
+		self.layout.prop(context.scene, "janus_gzip_level")
+		self.layout.prop(context.scene, "janus_gzip_threads")
 		self.layout.prop(context.scene, "janus_apply_rot")
 		self.layout.prop(context.scene, "janus_apply_scale")
 		self.layout.prop(context.scene, "janus_apply_pos")
@@ -123,6 +147,10 @@ class ExportSettingsPanel(Panel):
 
 Scene.janus_importpath = StringProperty(name="importpath", description="Specify the html page that includes the FireBoxHTML source", subtype="FILE_PATH", default="http://vesta.janusvr.com/kityandtom/freedome")
 #Scene.vesta_token = StringProperty(name="login token", description="Specify your token to authenticate with Vesta", default="")
+Scene.janus_import_origin = EnumProperty(name="Load Order", default="room", items=(("room", "Nearest to Spawn", "Fetch and build objects nearest to the room's spawn point first"), ("cursor", "Nearest to Cursor", "Fetch and build objects nearest to the 3D cursor first")))
+Scene.janus_import_radius = FloatProperty(name="Radius", description="Skip objects farther than this from the load order origin (0 imports everything)", default=0.0, min=0.0, max=100000.0)
+Scene.janus_import_placeholders = BoolProperty(name="Placeholders", description="Show a box for every object until its geometry is imported", default=False)
+Scene.janus_import_lazy = BoolProperty(name="Placeholders Only", description="Only create placeholders that keep the object attributes, load geometry later on demand", default=False)
 
 class ImportSettingsPanel(Panel):
 	bl_label = "Import Settings"
@@ -134,11 +162,19 @@ class ImportSettingsPanel(Panel):
 		self.layout.operator("import_scene.html")
 		col = self.layout.column()
 		col.prop(context.scene, "janus_importpath")
+		self.layout.prop(context.scene, "janus_import_origin")
+		self.layout.prop(context.scene, "janus_import_radius")
+		self.layout.prop(context.scene, "janus_import_placeholders")
+		self.layout.prop(context.scene, "janus_import_lazy")
+		self.layout.operator("import_scene.janus_load_geometry", text="Load Selected Geometry").selected_only = True
+		self.layout.operator("import_scene.janus_load_geometry", text="Load All Geometry").selected_only = False
 
 Scene.janus_rendermode = EnumProperty(name="", default="2d", items=(("2d", "2D", "2D"),("sbs","Side by Side", "Side by Side"),("sbs_reverse", "Side by Side Reverse", "Side by Side Reverse"),("rift", "Rift", "Rift")))
 Scene.janus_fullscreen = BoolProperty(name="JanusVR Fullscreen", default=True)
 Scene.janus_size = IntVectorProperty(name="", size=2, default=(640, 480), min=1, max=10000)
 Scene.janus_updaterate = IntProperty(name="Rate", default=100, min=1, max=5000)
+Scene.janus_preview = BoolProperty(name="Local HTTP Server", description="Open local exports through a server on this machine instead of file:// urls", default=True)
+Scene.janus_preview_port = IntProperty(name="Port", description="Port of the local server (0 picks a free one)", default=preview.default_port, min=0, max=2**16-1)
 
 class RunSettingsPanel(Panel):
 	bl_label = "Run Settings"
@@ -154,6 +190,10 @@ class RunSettingsPanel(Panel):
 		if not context.scene.janus_fullscreen:
 			self.layout.label(text="Window size")
 			self.layout.prop(context.scene, "janus_size")
+		self.layout.prop(context.scene, "janus_preview")
+		if context.scene.janus_preview:
+			self.layout.prop(context.scene, "janus_preview_port")
+			self.layout.label(text="Server: %s" % preview.preview.state)
 if bpy.app.version < (2, 80):
 	Scene.janus_object_export = EnumProperty(name="", default=".obj", items=((".obj", "Wavefront (.obj)", "Wavefront object files"),(".dae", "Collada (.dae)", "Collada files")))
 else:
@@ -492,44 +532,168 @@ class VestaToken(AddonPreferences):
 		layout = self.layout
 		layout.prop(self, "vestatoken")
 
-class VRImport(Operator):
+#use exportpath/tmp as working path
+def import_working_path(context):
+	exportpath = getv(context, "exportpath")
+	if not exportpath:
+		return None
+	workingpath = os.path.join(exportpath, "tmp")#time.strftime("%Y%m%d%H%M%S"))
+	os.makedirs(workingpath, exist_ok=True)
+	return workingpath
+
+# progress line in the status bar, None clears it
+def status_text(context, text):
+	workspace = getattr(context, "workspace", None)
+	if workspace is not None:
+		workspace.status_text_set(text)
+
+# Runs a generator of short steps from a timer with a progress bar, Esc closes the
+# generator. Subclasses call start() from invoke and implement finished/cancelled.
+# With block_input other events are swallowed while the steps run, for steps that
+# depend on the selection and active object staying as they are.
+class TimerStepsOperator:
+	block_input = False
+
+	def start(self, context, generator, progress):
+		self.steps = generator
+		self.progress = progress
+		wm = context.window_manager
+		self.timer = wm.event_timer_add(steps.time_slice, window=context.window)
+		wm.progress_begin(0, 100)
+		wm.modal_handler_add(self)
+		return {"RUNNING_MODAL"}
+
+	def modal(self, context, event):
+		if event.type == "ESC" and event.value == "PRESS":
+			self.steps.close()
+			self.finish(context)
+			self.cancelled(context)
+			return {"FINISHED"}
+		if event.type != "TIMER" or event.timer != self.timer:
+			return {"RUNNING_MODAL"} if self.block_input else {"PASS_THROUGH"}
+		try:
+			running = steps.run_slice(self.steps)
+		except Exception as e:
+			self.finish(context)
+			self.report({"ERROR"}, "%s failed: %s" % (self.bl_label, e))
+			return {"FINISHED"}
+		if not running:
+			self.finish(context)
+			self.finished(context)
+			return {"FINISHED"}
+		context.window_manager.progress_update(int(self.progress.fraction() * 100))
+		status_text(context, self.progress.text())
+		return {"PASS_THROUGH"}
+
+	def finish(self, context):
+		wm = context.window_manager
+		wm.event_timer_remove(self.timer)
+		wm.progress_end()
+		status_text(context, None)
+
+# From the UI the import runs modal and Esc cancels it, keeping what was built so far.
+# execute still imports in one go for scripts.
+class VRImport(TimerStepsOperator, Operator):
 	bl_idname = "import_scene.html"
 	bl_label = "Import FireBoxHTML"
 	bl_options = {"PRESET", "UNDO"}
 
+	def paths(self, context):
+		workingpath = import_working_path(context)
+		if not workingpath:
+			self.report({"ERROR"}, "Invalid export (working) path")
+			return None, None
+		importpath = context.scene.janus_importpath
+		if not importpath:
+			self.report({"ERROR"}, "Invalid import path")
+			return None, None
+		return importpath, workingpath
+
 	def execute(self, context):
-		#use exportpath/tmp as working path
-		exportpath = getv(context, "exportpath")
-		if exportpath:
-			workingpath = os.path.join(exportpath, "tmp")#time.strftime("%Y%m%d%H%M%S"))
-			os.makedirs(workingpath, exist_ok=True)
-			importpath = context.scene.janus_importpath
-			if importpath:
-				vr_import.load(self, context, filepath=importpath, workingpath=workingpath)
-				self.report({"INFO"}, "Imported from %s" % importpath)
-			else:
-				self.report({"ERROR"}, "Invalid import path")
-		else:
+		importpath, workingpath = self.paths(context)
+		if importpath:
+			vr_import.load(self, context, filepath=importpath, workingpath=workingpath)
+			self.report({"INFO"}, "Imported from %s" % importpath)
+		return {"FINISHED"}
+
+	def invoke(self, context, event):
+		self.importpath, workingpath = self.paths(context)
+		if not self.importpath:
+			return {"FINISHED"}
+		return self.start(context, vr_import.import_steps(self, context.scene, self.importpath, workingpath), vr_import.progress)
+
+	def finished(self, context):
+		self.report({"INFO"}, "Imported from %s" % self.importpath)
+
+	def cancelled(self, context):
+		self.report({"WARNING"}, "Import cancelled, kept %d of %d assets" % (vr_import.progress.assets_done, vr_import.progress.assets))
+
+class VRImportGeometry(Operator):
+	bl_idname = "import_scene.janus_load_geometry"
+	bl_label = "Load Geometry"
+	bl_options = {"PRESET", "UNDO"}
+
+	selected_only = BoolProperty(name="Selected Only", default=True)
+
+	def execute(self, context):
+		workingpath = import_working_path(context)
+		if not workingpath:
 			self.report({"ERROR"}, "Invalid export (working) path")
+			return {"FINISHED"}
+		objects = context.selected_objects if self.selected_only else context.scene.objects
+		proxies = [o for o in objects if o.type == "EMPTY" and "janus_object" in o]
+		if proxies:
+			vr_import.load_proxies(self, proxies, workingpath)
+		else:
+			self.report({"INFO"}, "No placeholders to load")
 		return {"FINISHED"}
 
-class VRExport(Operator):
+def export_directory(context):
+	exportpath = getv(context, "exportpath")
+	if not exportpath:
+		return None
+	filepath = os.path.join(exportpath, time.strftime("%Y%m%d%H%M%S"))
+	os.makedirs(filepath, exist_ok=True)
+	return filepath
+
+# Like the import, modal from the UI: bpy work is done an object per step while
+# copies and compression run in worker threads. execute exports in one go.
+class VRExport(TimerStepsOperator, Operator):
 	bl_idname = "export_scene.html"
 	bl_label = "Export FireBoxHTML"
 	bl_options = {"PRESET", "UNDO"}
+	# the exporters work on the selection and transform_apply on the active object
+	block_input = True
 
 	def execute(self, context):
-		exportpath = getv(context, "exportpath")
-		if exportpath:
-			filepath = os.path.join(exportpath, time.strftime("%Y%m%d%H%M%S"))
-			os.makedirs(filepath, exist_ok=True)
-			vr_export.save(self, context, filepath=filepath)
-			setv(context, "filepath", filepath)
-			self.report({"INFO"}, "Exported files to %s" % filepath)
+		self.filepath = export_directory(context)
+		if self.filepath:
+			vr_export.save(self, context, filepath=self.filepath)
+			self.finished(context)
 		else:
 			self.report({"ERROR"}, "Invalid export path")
 		return {"FINISHED"}
 
+	def invoke(self, context, event):
+		self.filepath = export_directory(context)
+		if not self.filepath:
+			self.report({"ERROR"}, "Invalid export path")
+			return {"FINISHED"}
+		return self.start(context, vr_export.export_steps(context.scene, self.filepath, "AUTO"), vr_export.progress)
+
+	def finished(self, context):
+		setv(context, "filepath", self.filepath)
+		cid = vr_export.progress.cid
+		setv(context, "roomcid", cid or "")
+		if cid:
+			context.scene.roomhash = getURL(context, [cid])
+			self.report({"INFO"}, "Exported files to %s, root %s" % (self.filepath, cid))
+		else:
+			self.report({"INFO"}, "Exported files to %s" % self.filepath)
+
+	def cancelled(self, context):
+		self.report({"WARNING"}, "Export cancelled, %s is incomplete" % self.filepath)
+
 class VRExportVesta(Operator):
 	bl_idname = "export_scene.vesta"
 	bl_label = "Export to VESTA"
@@ -554,34 +718,32 @@ class VRExportVesta(Operator):
 					return {"FINISHED"}
 				filepath = os.path.join(exportpath, timestamp)
 				os.makedirs(filepath, exist_ok=True)
-				vr_export.save(self, context, filepath=filepath, base_path=online_path+timestamp+'/')
+				vr_export.save(self, context, filepath=filepath)
 				setv(context, "filepath", filepath)
 				self.report({"INFO"}, "Exported files to %s" % filepath)
-				self.report({"INFO"}, 'Uploading, this may take a while.')
-				files = [f for f in os.listdir(filepath) if os.path.isfile(os.path.join(filepath, f))]
-				with tarfile.open(os.path.join(filepath,'vesta_'+timestamp+'.tar.gz'), "w:gz") as tar:
-					for file in files:
-						if not file.endswith('.tar.gz'):
-							tar.add(os.path.join(filepath, file), arcname=file)
-				files = {'file': open(os.path.join(filepath, 'vesta_'+timestamp+'.tar.gz'), 'rb')}
-				r = requests.post(self.vesta_upload_url, files=files, data={'token':vesta_token, 'path':'firevr/'+timestamp})
-				if r.status_code == requests.codes.ok:
-					index_contents = ''
-					with open(os.path.join(filepath, 'index.html'),'rb') as f_index:
-						index_contents = str(f_index.read(), 'utf-8')
-					data = {'token':vesta_token, 'public':False, 'nsfw':False, 'can_fork':False, 'sandbox':False, 'firebox':index_contents, 'body':'Exported from Blender using the FireVR exporter. Get it at https://github.com/Spyduck/FireVR', 'room_name':'FireVR Export ('+timestamp2+')', 'id':'create'}
-					r = requests.post(self.vesta_create_url, data=json.dumps(data))
-					if r.status_code == requests.codes.ok:
-						if r.json().get('error') == False:
-							redirect = r.json().get('redirect')
-							self.report({"INFO"}, redirect)
-							webbrowser.open(vesta_base_url+redirect+'/edit', new=1, autoraise=True)
-						else:
-							self.report({"ERROR"}, 'Error from VESTA: '+str(r.json().get('message',None)))
-					else:
-						self.report({"ERROR"}, str(r.status_code))
-				else:
-					self.report({"ERROR"}, str(r.status_code))
+				# only files not uploaded before go up, the others keep their earlier urls
+				remote_path = online_path+timestamp+'/'
+				manifest_path = os.path.join(exportpath, vesta.manifest_name)
+				manifest = vesta.load_manifest(manifest_path)
+				uploaded = manifest.setdefault(online_path, {})
+				names = vesta.archive_names(filepath)
+				dependencies = vesta.file_dependencies(filepath, names)
+				digests = vesta.content_digests(filepath, names, dependencies)
+				upload, reuse = vesta.plan_upload(names, digests, dependencies, uploaded)
+				vesta.relink(filepath, names, remote_path, reuse)
+				self.report({"INFO"}, "%d files unchanged since an earlier upload" % len(reuse))
+				index_contents = ''
+				with open(os.path.join(filepath, 'index.html'),'rb') as f_index:
+					index_contents = str(f_index.read(), 'utf-8')
+				data = {'public':False, 'nsfw':False, 'can_fork':False, 'sandbox':False, 'firebox':index_contents, 'body':'Exported from Blender using the FireVR exporter. Get it at https://github.com/Spyduck/FireVR', 'room_name':'FireVR Export ('+timestamp2+')', 'id':'create'}
+				job = {'directory':filepath, 'upload_url':self.vesta_upload_url, 'fields':[['path', 'firevr/'+timestamp]], 'timestamp':timestamp, 'parts':vesta.split_parts(filepath, upload), 'done':[],
+					'create_url':self.vesta_create_url, 'room':data,
+					'manifest':manifest_path, 'files_path':online_path, 'remote_path':remote_path, 'digests':digests, 'upload':upload,
+					'gzip_level':context.scene.janus_gzip_level, 'gzip_threads':context.scene.janus_gzip_threads}
+				# the token stays out of the saved queue, the uploader adds it when sending
+				vesta.uploader.submit(os.path.join(exportpath, vesta.queue_name), job, vesta_token)
+				self.report({"INFO"}, 'Uploading in the background, see the VESTA panel.')
+				watch_uploads()
 			else:
 				self.report({"ERROR"}, "Invalid VESTA token")
 		elif not exportpath:
@@ -590,6 +752,70 @@ class VRExportVesta(Operator):
 			self.report({"ERROR"}, "Invalid VESTA token")
 		return {"FINISHED"}
 
+def watch_uploads():
+	if not VRVestaWatch.watching:
+		bpy.ops.export_scene.vesta_watch('INVOKE_DEFAULT')
+
+# Shows upload progress while the queue runs and opens the rooms it created
+class VRVestaWatch(Operator):
+	bl_idname = "export_scene.vesta_watch"
+	bl_label = "Watch VESTA Uploads"
+
+	watching = False
+
+	def invoke(self, context, event):
+		VRVestaWatch.watching = True
+		wm = context.window_manager
+		wm.progress_begin(0, 1)
+		self.timer = wm.event_timer_add(0.5, window=context.window)
+		wm.modal_handler_add(self)
+		return {"RUNNING_MODAL"}
+
+	def modal(self, context, event):
+		if event.type != "TIMER" or event.timer != self.timer:
+			return {"PASS_THROUGH"}
+		wm = context.window_manager
+		wm.progress_update(vesta.uploader.fraction)
+		for area in context.screen.areas:
+			if area.type == "VIEW_3D":
+				area.tag_redraw()
+		for job, response in vesta.uploader.take_finished():
+			if response.get('error') == False:
+				redirect = response.get('redirect')
+				self.report({"INFO"}, redirect)
+				webbrowser.open(vesta_base_url+redirect+'/edit', new=1, autoraise=True)
+			else:
+				self.report({"ERROR"}, 'Error from VESTA: '+str(response.get('message',None)))
+		if vesta.uploader.running():
+			return {"PASS_THROUGH"}
+		wm.event_timer_remove(self.timer)
+		wm.progress_end()
+		VRVestaWatch.watching = False
+		if vesta.uploader.waiting():
+			self.report({"WARNING"}, "VESTA upload %s" % vesta.uploader.state)
+		return {"FINISHED"}
+
+class VRVestaResume(Operator):
+	bl_idname = "export_scene.vesta_resume"
+	bl_label = "Resume Upload"
+
+	def execute(self, context):
+		vesta_token = getv(context, 'vestatoken')
+		if not vesta_token:
+			self.report({"ERROR"}, "Invalid VESTA token")
+			return {"FINISHED"}
+		vesta.uploader.start(vesta_token)
+		watch_uploads()
+		return {"FINISHED"}
+
+class VRVestaStop(Operator):
+	bl_idname = "export_scene.vesta_stop"
+	bl_label = "Stop Upload"
+
+	def execute(self, context):
+		vesta.uploader.stop()
+		return {"FINISHED"}
+
 def getURL(context, hashes):
 	if context.scene.janus_gateway:
 		return "http://gateway.ipfs.io/ipfs/"+hashes[-1]+"/index.html"
@@ -610,18 +836,44 @@ class VRJanus(Operator):
 			return {"FINISHED"}
 
 		if context.scene.janus_ipfs:
-			ipfs.start()
+			# a daemon that is still starting is waited for from a timer, which runs this again
+			if not ipfs.manager.start().is_set():
+				if ipfs.manager.state != "starting":
+					self.report({"ERROR"}, "IPFS daemon %s" % ipfs.manager.state)
+					return {"FINISHED"}
+				if not VRIpfsWait.waiting:
+					bpy.ops.export_scene.ipfs_wait('INVOKE_DEFAULT')
+				self.report({"INFO"}, "Starting the IPFS daemon, JanusVR follows once it is ready")
+				return {"FINISHED"}
 
-			hashes = ipfs.addRecursive(filepath)
+			hashes = None
+			if context.scene.janus_ipfs_incremental:
+				try:
+					hashes = [ipfs.addIncremental(filepath, os.path.join(os.path.dirname(filepath), "ipfs_published.json"))]
+				except Exception as e:
+					# e.g. a daemon without dag import
+					self.report({"WARNING"}, "Incremental publish failed, adding everything: %s" % e)
+			if not hashes:
+				hashes = ipfs.addRecursive(filepath)
 
 			if not hashes:
 				self.report({"ERROR"}, "IPFS Error")
 				return {"FINISHED"}
 
+			cid = hasv(context, "roomcid")
+			if cid and cid != hashes[-1]:
+				self.report({"WARNING"}, "IPFS added %s, the export computed %s" % (hashes[-1], cid))
+
 			gateway = getURL(context, hashes)
 
 			context.scene.roomhash = gateway
 
+			# JanusVR starts on the /ipfs/ url right away, the name follows when it can
+			if context.scene.janus_ipns:
+				ipfs.publisher.submit("/ipfs/"+hashes[-1], context.scene.janus_ipnsname)
+				if not VRIpnsWatch.watching:
+					bpy.ops.export_scene.ipns_watch('INVOKE_DEFAULT')
+
 			self.report({"INFO"}, "Starting JanusVR on %s" % gateway)
 
 		args = []
@@ -638,8 +890,15 @@ class VRJanus(Operator):
 		args += ["-rate", str(context.scene.janus_updaterate)]
 
 		if not context.scene.janus_ipfs:
-			filepath = os.path.join(filepath, "index.html")
-			print(filepath)
+			if context.scene.janus_preview:
+				try:
+					roomurl = preview.preview.serve(filepath, context.scene.janus_preview_port)
+				except OSError as e:
+					self.report({"ERROR"}, "Could not start the local server: %s" % e)
+					return {"FINISHED"}
+			else:
+				roomurl = 'file:///'+os.path.join(filepath, "index.html").replace('\\','/')
+			print(roomurl)
 		januspath = hasv(context, "januspath")
 		if januspath:
 			params = {}
@@ -648,21 +907,97 @@ class VRJanus(Operator):
 			if context.scene.janus_ipfs:
 				subprocess.Popen([januspath]+args+[gateway], close_fds=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
 			else:
-				subprocess.Popen([januspath]+args+['file:///'+filepath.replace('\\','/')])
+				subprocess.Popen([januspath]+args+[roomurl])
 		else:
 			self.report({"ERROR"}, "JanusVR path not set")
 		return {"FINISHED"}
 
-class VRFire(Operator):
+# Redraws the panel while an IPNS publish runs and reports how it ended
+class VRIpnsWatch(Operator):
+	bl_idname = "export_scene.ipns_watch"
+	bl_label = "Watch IPNS Publish"
+
+	watching = False
+
+	def invoke(self, context, event):
+		VRIpnsWatch.watching = True
+		wm = context.window_manager
+		self.timer = wm.event_timer_add(0.5, window=context.window)
+		wm.modal_handler_add(self)
+		return {"RUNNING_MODAL"}
+
+	def modal(self, context, event):
+		if event.type != "TIMER" or event.timer != self.timer:
+			return {"PASS_THROUGH"}
+		for area in context.screen.areas:
+			if area.type == "VIEW_3D":
+				area.tag_redraw()
+		if not ipfs.publisher.done():
+			return {"PASS_THROUGH"}
+		context.window_manager.event_timer_remove(self.timer)
+		VRIpnsWatch.watching = False
+		self.report({"WARNING"} if ipfs.publisher.state.startswith("failed") else {"INFO"}, "IPNS %s" % ipfs.publisher.state)
+		return {"FINISHED"}
+
+# Waits for the IPFS daemon without blocking the UI and starts JanusVR once it is ready
+class VRIpfsWait(Operator):
+	bl_idname = "export_scene.ipfs_wait"
+	bl_label = "Wait for IPFS Daemon"
+
+	waiting = False
+
+	def invoke(self, context, event):
+		VRIpfsWait.waiting = True
+		wm = context.window_manager
+		self.timer = wm.event_timer_add(0.25, window=context.window)
+		wm.modal_handler_add(self)
+		return {"RUNNING_MODAL"}
+
+	def modal(self, context, event):
+		if event.type != "TIMER" or event.timer != self.timer:
+			return {"PASS_THROUGH"}
+		for area in context.screen.areas:
+			if area.type == "VIEW_3D":
+				area.tag_redraw()
+		ready = ipfs.manager.ready.is_set()
+		if not ready and ipfs.manager.state == "starting":
+			return {"PASS_THROUGH"}
+		context.window_manager.event_timer_remove(self.timer)
+		VRIpfsWait.waiting = False
+		if ready:
+			bpy.ops.export_scene.vrjanus()
+		else:
+			self.report({"ERROR"}, "IPFS daemon %s" % ipfs.manager.state)
+		return {"FINISHED"}
+
+class VRIpfsDaemon(Operator):
+	bl_idname = "export_scene.ipfs_daemon"
+	bl_label = "Start IPFS Daemon"
+
+	def execute(self, context):
+		# does not wait, the panel shows when the API is ready
+		ipfs.manager.start()
+		return {"FINISHED"}
+
+# exports like VRExport and starts JanusVR once the files are complete
+class VRFire(TimerStepsOperator, Operator):
 	bl_idname = "fire.html"
 	bl_label = "Start JanusVR"
 	bl_options = {"PRESET", "UNDO"}
 
+	invoke = VRExport.invoke
+	cancelled = VRExport.cancelled
+	block_input = True
+
 	def execute(self, context):
 		bpy.ops.export_scene.html()
 		bpy.ops.export_scene.vrjanus()
 		return {"FINISHED"}
 
+	def finished(self, context):
+		VRExport.finished(self, context)
+		bpy.ops.export_scene.vrjanus()
+
 custom_icons = None
 
 def register():
@@ -683,6 +1018,9 @@ def register():
 def unregister():
 	global custom_icons
 	bpy.utils.previews.remove(custom_icons)
+	ipfs.manager.stop()
+	vesta.uploader.stop()
+	preview.preview.stop()
 	for cls in reversed(classes):
 		try:
 			bpy.utils.unregister_class(cls)
@@ -718,9 +1056,16 @@ classes = ( ToolPanel,
 	VestaGetToken,
 	VestaToken,
 	VRImport,
+	VRImportGeometry,
 	VRExport,
 	VRExportVesta,
 	VRJanus,
+	VRIpfsDaemon,
+	VRIpfsWait,
+	VRIpnsWatch,
+	VRVestaWatch,
+	VRVestaResume,
+	VRVestaStop,
 	VRFire,
 )
 
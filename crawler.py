@@ -0,0 +1,306 @@
+# Mirrors a network of FireBox rooms by following their Link tags, no bpy in here.
+# Runs inside Blender or standalone:
+#   python crawler.py https://example.com/room.html --out mirror --depth 2
+import os
+import io
+import re
+import sys
+import json
+import time
+import gzip
+import argparse
+import posixpath
+import threading
+import traceback
+import urllib.request as urlreq
+from concurrent.futures import ThreadPoolExecutor, wait
+from urllib.parse import urlsplit, unquote, quote
+from hashlib import md5 as hashlib_md5
+
+if __package__:
+	from . import firebox, urls, gltf
+else:
+	# the addon's html.py would shadow the standard library module firebox needs
+	import importlib.util
+	_here = os.path.dirname(os.path.abspath(__file__))
+	sys.path = [p for p in sys.path if os.path.abspath(p or os.curdir) != _here]
+	def _sibling(name):
+		spec = importlib.util.spec_from_file_location(name, os.path.join(_here, name+".py"))
+		module = importlib.util.module_from_spec(spec)
+		spec.loader.exec_module(module)
+		return module
+	urls = _sibling("urls")
+	firebox = _sibling("firebox")
+	gltf = _sibling("gltf")
+# only once the addon directory is off sys.path, see above
+from html import escape, unescape
+
+manifest_name = "manifest.json"
+# attributes holding the files of each asset element
+asset_attributes = {
+	"assetobject": ("src", "mtl", "tex"),
+	"assetimage": ("src",),
+	"assetsound": ("src",),
+	"assetvideo": ("src",),
+	"assetscript": ("src",),
+	"assetshader": ("src", "vertex_src"),
+	"assetghost": ("src",),
+}
+followed_schemes = ("http", "https", "file")
+mtl_texture = re.compile(r"^\s*(?:map_\w+|bump|disp|refl)\s.*?(\S+)\s*$", re.MULTILINE)
+mtllib = re.compile(rb"^\s*mtllib\s+(.+?)\s*$", re.MULTILINE)
+# attributes of mirrored rooms pointing at files that may be in the mirror as well
+reference = re.compile(r"""\b(src|mtl|tex|vertex_src|url)(\s*=\s*)(?:"([^"]*)"|'([^']*)')""", re.IGNORECASE)
+# mirrored rooms keep the page as fetched next to the rewritten one
+source_suffix = ".orig"
+url_timeout = 30
+
+# Where a url is stored in the mirror: host/path, so relative references between
+# mirrored files still work and a mirrored room can be imported from disk
+def mirror_path(url):
+	parts = urlsplit(url)
+	host = parts.netloc.replace(":", "_") if parts.scheme != "file" else "local"
+	path = unquote(parts.path).lstrip("/")
+	if not path or path.endswith("/"):
+		path += "index.html"
+	if parts.query:
+		name, ext = os.path.splitext(path)
+		path = "%s_%s%s" % (name, hashlib_md5(parts.query.encode("utf-8")).hexdigest()[:8], ext)
+	# no way out of the mirror, whatever the url
+	path = "/".join(p for p in path.split("/") if p not in ("", ".", ".."))
+	return os.path.join(host, *path.split("/"))
+
+def followable(url):
+	return urlsplit(url).scheme in followed_schemes
+
+def decompressed(data, url):
+	if url.endswith(".gz"):
+		try:
+			return gzip.decompress(data)
+		except OSError:
+			pass
+	return data
+
+# Files an asset pulls in by itself: materials of .obj, textures of .mtl, buffers and images of .gltf
+def dependencies(url, data):
+	data = decompressed(data, url)
+	name = url[:-3] if url.endswith(".gz") else url
+	name = urls.basename(name).lower()
+	found = []
+	if name.endswith(".obj"):
+		found = [m.decode("utf-8", "replace") for m in mtllib.findall(data)]
+	elif name.endswith(".mtl"):
+		found = mtl_texture.findall(data.decode("utf-8", "replace"))
+	elif name.endswith(".gltf"):
+		try:
+			found = [uri for _, _, uri in gltf.external_uris(json.loads(data.decode("utf-8")))]
+		except ValueError:
+			pass
+	return [urls.resolve(urls.directory(url), ref) for ref in found]
+
+class Room:
+	def __init__(self, url, depth):
+		self.url = url
+		self.depth = depth
+		self.title = None
+		self.links = []
+		self.assets = []
+
+	def on_element(self, element):
+		if element.name == "room":
+			self.title = element.get("title")
+		elif element.name == "link" and element.get("url"):
+			link = urls.resolve(urls.directory(self.url), element["url"])
+			if followable(link) and link not in self.links:
+				self.links.append(link)
+		elif element.name in asset_attributes:
+			for key in asset_attributes[element.name]:
+				if element.get(key):
+					asset = urls.resolve(urls.directory(self.url), element[key])
+					if followable(asset) and asset not in self.assets:
+						self.assets.append(asset)
+
+# Breadth-first crawl from one room. Every url is fetched at most once, also
+# across crawls into the same mirror, and never more than host_limit at a time per host.
+class Crawler:
+	def __init__(self, out, depth=1, host_limit=2, workers=8, max_rooms=None, log=print):
+		self.out = out
+		self.depth = depth
+		self.host_limit = host_limit
+		self.workers = workers
+		self.max_rooms = max_rooms
+		self.log = log
+		self.lock = threading.Lock()
+		self.hosts = {}
+		self.fetches = {}
+		self.rooms = {}
+		self.files = {}
+		self.cancelled = threading.Event()
+		self.load_manifest()
+
+	def load_manifest(self):
+		try:
+			with open(os.path.join(self.out, manifest_name), "r", encoding="utf-8") as f:
+				manifest = json.load(f)
+			self.files = manifest.get("files", {})
+			self.rooms = manifest.get("rooms", {})
+		except (OSError, ValueError):
+			pass
+
+	def save_manifest(self, root):
+		manifest = {"root": root, "crawled": time.strftime("%Y-%m-%d %H:%M:%S"), "rooms": self.rooms, "files": self.files}
+		os.makedirs(self.out, exist_ok=True)
+		path = os.path.join(self.out, manifest_name)
+		with open(path+".tmp", "w", encoding="utf-8") as f:
+			json.dump(manifest, f, indent=1, sort_keys=True)
+		os.replace(path+".tmp", path)
+		return path
+
+	def host_slot(self, url):
+		host = urlsplit(url).netloc
+		with self.lock:
+			if host not in self.hosts:
+				self.hosts[host] = threading.Semaphore(self.host_limit)
+			return self.hosts[host]
+
+	# bytes of url, from the mirror if an earlier crawl already stored it
+	def fetch(self, url):
+		entry = self.files.get(url)
+		if entry and "file" in entry:
+			path = os.path.join(self.out, entry.get("source", entry["file"]))
+			if os.path.exists(path):
+				with open(path, "rb") as f:
+					return f.read()
+		if self.cancelled.is_set():
+			return None
+		relative = mirror_path(url)
+		path = os.path.join(self.out, relative)
+		try:
+			with self.host_slot(url):
+				with urlreq.urlopen(url, timeout=url_timeout) as response:
+					data = response.read()
+		except Exception as e:
+			self.log("Could not fetch", url, e)
+			with self.lock:
+				self.files[url] = {"error": str(e)}
+			return None
+		os.makedirs(os.path.dirname(path), exist_ok=True)
+		with open(path+".part", "wb") as f:
+			f.write(data)
+		os.replace(path+".part", path)
+		with self.lock:
+			self.files[url] = {"file": relative.replace(os.sep, "/"), "size": len(data)}
+		return data
+
+	# one future per url, rooms sharing an asset share its download
+	def submit(self, pool, fn, url):
+		with self.lock:
+			if url not in self.fetches:
+				self.fetches[url] = pool.submit(fn, url)
+			return self.fetches[url]
+
+	def fetch_asset(self, url, pool):
+		data = self.fetch(url)
+		if data is not None:
+			for dependency in dependencies(url, data):
+				self.submit(pool, lambda u: self.fetch_asset(u, pool), dependency)
+
+	def fetch_room(self, url, depth, pool):
+		data = self.fetch(url)
+		if data is None:
+			return None
+		room = Room(url, depth)
+		reader = firebox.read(io.BytesIO(data), room.on_element)
+		if not reader.started:
+			self.log("No FireBoxRoom in", url)
+			return None
+		for asset in room.assets:
+			self.submit(pool, lambda u: self.fetch_asset(u, pool), asset)
+		with self.lock:
+			self.rooms[url] = {"file": self.files[url].get("file"), "depth": depth, "title": room.title, "links": room.links, "assets": room.assets}
+		return room
+
+	# Points the references of a mirrored room at the mirrored files, relative to the
+	# room, so it works from disk. The page as fetched is kept for later crawls.
+	def rewrite_room(self, url):
+		entry = self.files.get(url)
+		if not entry or "file" not in entry:
+			return
+		relative = entry["file"]
+		path = os.path.join(self.out, relative)
+		source = relative + source_suffix
+		if "source" not in entry:
+			os.replace(path, os.path.join(self.out, source))
+			entry["source"] = source
+		with open(os.path.join(self.out, source), "rb") as f:
+			html = f.read().decode("utf-8", "surrogateescape")
+		base = urls.directory(url)
+		def link(match):
+			key, equals, double, single = match.groups()
+			value = double if double is not None else single
+			target = self.files.get(urls.resolve(base, unescape(value)))
+			if not target or "file" not in target:
+				return match.group(0)
+			mirrored = posixpath.relpath(target["file"], posixpath.dirname(relative) or ".")
+			return '%s%s"%s"' % (key, equals, escape(quote(mirrored, safe="/"), quote=True))
+		with open(path+".part", "wb") as f:
+			f.write(reference.sub(link, html).encode("utf-8", "surrogateescape"))
+		os.replace(path+".part", path)
+
+	def crawl(self, root):
+		root = urls.canonical(root if followable(root) else urls.file_url(root))
+		start = time.perf_counter()
+		seen = {root}
+		level = [root]
+		crawled = 0
+		with ThreadPoolExecutor(max_workers=self.workers) as pool:
+			for depth in range(self.depth+1):
+				if self.max_rooms is not None:
+					level = level[:max(0, self.max_rooms - crawled)]
+				if not level or self.cancelled.is_set():
+					break
+				self.log("Depth %d: %d rooms" % (depth, len(level)))
+				futures = [pool.submit(self.fetch_room, url, depth, pool) for url in level]
+				crawled += len(level)
+				level = []
+				for future in futures:
+					try:
+						room = future.result()
+					except Exception:
+						self.log(traceback.format_exc())
+						continue
+					if room is None:
+						continue
+					for link in room.links:
+						if link not in seen:
+							seen.add(link)
+							level.append(link)
+			# assets keep adding their dependencies, wait until nothing is left
+			while True:
+				with self.lock:
+					pending = [f for f in self.fetches.values() if not f.done()]
+				if not pending:
+					break
+				wait(pending)
+		for url in self.rooms:
+			try:
+				self.rewrite_room(url)
+			except (OSError, ValueError) as e:
+				self.log("Could not rewrite", url, e)
+		path = self.save_manifest(root)
+		self.log("Mirrored %d rooms and %d files in %.1fs, manifest: %s" % (len(self.rooms), len(self.files), time.perf_counter() - start, path))
+		return path
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description="Mirror FireBox rooms and the rooms they link to")
+	parser.add_argument("url", help="room to start from, url or local file")
+	parser.add_argument("--out", default="mirror", help="mirror directory, also reused as download cache")
+	parser.add_argument("--depth", type=int, default=1, help="how many links to follow away from the first room")
+	parser.add_argument("--per-host", type=int, default=2, help="concurrent requests per host")
+	parser.add_argument("--workers", type=int, default=8, help="concurrent requests overall")
+	parser.add_argument("--max-rooms", type=int, default=None)
+	args = parser.parse_args(argv)
+	Crawler(args.out, args.depth, args.per_host, args.workers, args.max_rooms).crawl(args.url)
+
+if __name__ == "__main__":
+	main()
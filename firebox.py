@@ -0,0 +1,212 @@
+# Streaming FireBoxRoom reader, no bpy in here
+import os
+import re
+import json
+import codecs
+import tempfile
+import urllib.request as urlreq
+from urllib.error import HTTPError
+from hashlib import md5 as hashlib_md5
+from html.parser import HTMLParser
+
+fireboxroom_start = re.compile(r"<fireboxroom[\s>/]", re.IGNORECASE)
+# elements whose text content matters, they are emitted at their end tag
+text_elements = ("text", "paragraph", "assetscript")
+
+# Lightweight stand-in for a bs4 Tag, only what the importer uses
+class Element:
+	def __init__(self, name, attrs, parent=None):
+		self.name = name
+		self.attrs = attrs
+		self.parent = parent
+		self.text = ""
+
+	def get(self, key, default=None):
+		return self.attrs.get(key, default)
+
+	def __getitem__(self, key):
+		return self.attrs[key]
+
+	def __contains__(self, key):
+		return key in self.attrs
+
+	def __repr__(self):
+		return "<%s %r>" % (self.name, self.attrs)
+
+# Calls handler(element) for every element inside the FireBoxRoom as soon as it
+# has been read, so the caller can act on it while the page is still arriving.
+# Everything before the FireBoxRoom (including the html comment that usually
+# wraps it) is dropped unparsed, and reading stops at </FireBoxRoom>.
+class FireBoxReader(HTMLParser):
+	def __init__(self, handler):
+		HTMLParser.__init__(self, convert_charrefs=True)
+		self.handler = handler
+		self.started = False
+		self.done = False
+		self.pending = ""
+		self.section = None
+		self.text_element = None
+		self.count = 0
+
+	def feed(self, data):
+		if self.done:
+			return
+		if not self.started:
+			self.pending += data
+			match = fireboxroom_start.search(self.pending)
+			if match is None:
+				# keep enough to match a start tag split across chunks
+				self.pending = self.pending[-16:]
+				return
+			data = self.pending[match.start():]
+			self.pending = ""
+			self.started = True
+		HTMLParser.feed(self, data)
+
+	def emit(self, element):
+		self.count += 1
+		self.handler(element)
+
+	def handle_starttag(self, name, attrs):
+		if self.done:
+			return
+		if name == "fireboxroom":
+			return
+		element = Element(name, {k: ("" if v is None else v) for k, v in attrs}, self.section)
+		if name in ("assets", "room"):
+			self.section = name
+		if name in text_elements:
+			self.text_element = element
+		else:
+			self.emit(element)
+
+	def handle_endtag(self, name):
+		if self.done:
+			return
+		if name == "fireboxroom":
+			self.done = True
+		elif name == self.section:
+			self.section = None
+		elif self.text_element is not None and name == self.text_element.name:
+			element = self.text_element
+			self.text_element = None
+			self.emit(element)
+
+	def handle_data(self, data):
+		if self.text_element is not None and not self.done:
+			self.text_element.text += data
+
+	def close(self):
+		if self.started:
+			HTMLParser.close(self)
+		if self.text_element is not None:
+			element = self.text_element
+			self.text_element = None
+			self.emit(element)
+
+# Reads a file-like object in chunks and feeds it through a FireBoxReader
+def read(source, handler, chunk_size=64*1024, encoding="utf-8"):
+	reader = FireBoxReader(handler)
+	decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+	while not reader.done:
+		chunk = source.read(chunk_size)
+		if not chunk:
+			break
+		reader.feed(decoder.decode(chunk))
+	if not reader.done:
+		reader.feed(decoder.decode(b"", final=True))
+	reader.close()
+	return reader
+
+# Elements worth keeping for a re-import, whatever the importer does with them
+cached_elements = ("room", "assetobject", "object")
+
+# Reads hashing everything that passes through
+# Hashes what is read through it, and copies it to copy when given one
+class HashingReader:
+	def __init__(self, source, copy=None):
+		self.source = source
+		self.copy = copy
+		self.md5 = hashlib_md5()
+
+	def read(self, size=-1):
+		data = self.source.read(size)
+		self.md5.update(data)
+		if self.copy is not None:
+			self.copy.write(data)
+		return data
+
+def load_cache(path):
+	try:
+		with open(path, 'r', encoding='utf-8') as f:
+			return json.load(f)
+	except (OSError, ValueError):
+		return None
+
+def save_cache(path, etag, digest, count, elements):
+	os.makedirs(os.path.dirname(path), exist_ok=True)
+	with open(path+'.tmp', 'w', encoding='utf-8') as f:
+		json.dump({"etag": etag, "md5": digest, "count": count, "elements": elements}, f, separators=(',', ':'))
+	os.replace(path+'.tmp', path)
+
+# A cached room stands in for the reader, it was only cached if it had a FireBoxRoom
+class CachedRoom:
+	def __init__(self, cache, handler):
+		self.started = True
+		self.done = True
+		self.count = cache["count"]
+		self.cached = True
+		for name, attrs, parent in cache["elements"]:
+			handler(Element(name, attrs, parent))
+
+# Like read, but for a page url with the elements kept in cache_dir. An unchanged
+# page, known by its ETag or else by its content hash, is replayed from there
+# without being parsed, and with a matching ETag without being downloaded.
+def read_url(url, handler, cache_dir, timeout=None):
+	path = os.path.join(cache_dir, hashlib_md5(url.encode('utf-8')).hexdigest()+'.json')
+	cache = load_cache(path)
+	request = urlreq.Request(url)
+	if cache and cache.get("etag"):
+		request.add_header("If-None-Match", cache["etag"])
+	try:
+		source = urlreq.urlopen(request, timeout=timeout)
+	except HTTPError as e:
+		if e.code == 304 and cache:
+			return CachedRoom(cache, handler)
+		raise
+	elements = []
+	def record(element):
+		if element.name in cached_elements:
+			elements.append((element.name, element.attrs, element.parent))
+		handler(element)
+	def parse(stream):
+		hashing = HashingReader(stream)
+		reader = read(hashing, record)
+		# the hash is over the whole page, like the one it is compared with
+		while hashing.read(64*1024):
+			pass
+		return reader, hashing.md5.hexdigest()
+	with source:
+		etag = source.headers.get("ETag")
+		if cache and etag and etag == cache.get("etag"):
+			return CachedRoom(cache, handler)
+		if cache:
+			# No ETag to go by, the content decides. The page goes to a file on the
+			# way through, so it can be parsed from there if it changed.
+			with tempfile.TemporaryFile(dir=cache_dir) as spool:
+				tee = HashingReader(source, spool)
+				while tee.read(64*1024):
+					pass
+				if tee.md5.hexdigest() == cache.get("md5"):
+					return CachedRoom(cache, handler)
+				spool.seek(0)
+				reader, digest = parse(spool)
+		else:
+			reader, digest = parse(source)
+	reader.cached = False
+	if reader.started:
+		try:
+			save_cache(path, etag, digest, reader.count, elements)
+		except OSError as e:
+			print('Could not cache room', url, e)
+	return reader
@@ -0,0 +1,83 @@
+# glTF 2.0 helpers for the importer, no bpy in here
+import os
+import json
+import mmap
+import struct
+
+GLB_MAGIC = b'glTF'
+GLB_HEADER = struct.Struct('<4sII')
+GLB_CHUNK = struct.Struct('<II')
+CHUNK_JSON = 0x4E4F534A
+CHUNK_BIN = 0x004E4942
+
+def is_glb(path):
+	with open(path, 'rb') as f:
+		return f.read(4) == GLB_MAGIC
+
+# yields (section, index, uri) for every buffer/image that lives outside the file
+def external_uris(content):
+	for section in ('buffers', 'images'):
+		for i, entry in enumerate(content.get(section, [])):
+			uri = entry.get('uri', None)
+			if uri and not uri.startswith('data:'):
+				yield section, i, uri
+
+# A .glb mapped read-only. Only the JSON chunk is ever decoded, the BIN chunk
+# stays in the mapping and is written back out as a memoryview slice.
+class GlbFile:
+	def __init__(self, path):
+		self.path = path
+		self.file = open(path, 'rb')
+		try:
+			self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+		except ValueError:
+			self.file.close()
+			raise ValueError('Empty file: '+path)
+		self.view = memoryview(self.map)
+		try:
+			magic, self.version, self.length = GLB_HEADER.unpack_from(self.view, 0)
+			if magic != GLB_MAGIC:
+				raise ValueError('Not a glTF binary: '+path)
+			self.length = min(self.length, len(self.view))
+			json_length, json_type = GLB_CHUNK.unpack_from(self.view, GLB_HEADER.size)
+			if json_type != CHUNK_JSON:
+				raise ValueError('First GLB chunk is not JSON: '+path)
+			json_start = GLB_HEADER.size + GLB_CHUNK.size
+			self.rest_offset = json_start + json_length
+			self.content = json.loads(str(self.view[json_start:self.rest_offset], 'utf-8'))
+		except (struct.error, ValueError):
+			self.close()
+			raise
+
+	# the BIN chunk (header included) and any further chunks, not copied
+	def rest(self):
+		return self.view[self.rest_offset:self.length]
+
+	def save(self, content=None):
+		if content is None:
+			content = self.content
+		data = json.dumps(content, separators=(',', ':')).encode('utf-8')
+		data += b' ' * (-len(data) % 4)
+		rest = self.rest()
+		tmp_path = self.path+'.tmp'
+		with open(tmp_path, 'wb') as f:
+			f.write(GLB_HEADER.pack(GLB_MAGIC, self.version, GLB_HEADER.size + GLB_CHUNK.size + len(data) + len(rest)))
+			f.write(GLB_CHUNK.pack(len(data), CHUNK_JSON))
+			f.write(data)
+			f.write(rest)
+		rest.release()
+		self.close()
+		os.replace(tmp_path, self.path)
+
+	def close(self):
+		if self.view is not None:
+			self.view.release()
+			self.view = None
+			self.map.close()
+			self.file.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
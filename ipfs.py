@@ -1,69 +1,486 @@
-from subprocess import Popen, call, check_output, STDOUT, PIPE, CalledProcessError
+from subprocess import Popen, call, check_output, STDOUT, PIPE, CalledProcessError, TimeoutExpired
 from tempfile import TemporaryFile, NamedTemporaryFile, tempdir
+from urllib.parse import urlencode, quote
+import http.client
+import socket
+import threading
+import tarfile
 import base64
+import io
+import json
+import uuid
+import time
 import os
 
+from . import unixfs
+
 DEVNULL = open(os.devnull, "wb")
 
 CALL_OPTIONS = {"stderr" : DEVNULL}
 CALL_OPTIONS = {"stdout" : DEVNULL}
 
+# where the daemon's RPC API listens unless IPFS_API or $IPFS_PATH/api say otherwise
+DEFAULT_API = ("127.0.0.1", 5001)
+# seconds a freshly started daemon gets to answer on its API
+READY_TIMEOUT = 60
+# seconds the daemon may stay silent during a call before it counts as gone
+CALL_TIMEOUT = 120
+CHUNK_SIZE = 256*1024
+
+class IpfsError(Exception):
+    pass
+
 def init():
     call(["ipfs", "init"], stdout=DEVNULL, stderr=DEVNULL)
 
-def daemon():
+# (host, port) of the API from a multiaddr like /ip4/127.0.0.1/tcp/5001
+def parse_multiaddr(addr):
+    parts = addr.strip().split("/")
     try:
-        Popen(["ipfs", "daemon"], stdout=DEVNULL, stderr=DEVNULL)
-    except CalledProcessError:
-        pass
-
-def start():
-    init()
-    daemon()
-  
-def add(path, pin=True):
-    if type(path)==str:
-        output = check_output(["ipfs", "add", path]).decode("ascii")
-    else:
+        return parts[2], int(parts[4])
+    except (IndexError, ValueError):
+        return None
+
+def repo_path():
+    return os.environ.get("IPFS_PATH", os.path.join(os.path.expanduser("~"), ".ipfs"))
+
+def api_address():
+    if os.environ.get("IPFS_API"):
+        return parse_multiaddr(os.environ["IPFS_API"]) or DEFAULT_API
+    try:
+        with open(os.path.join(repo_path(), "api")) as f:
+            return parse_multiaddr(f.read()) or DEFAULT_API
+    except OSError:
+        return DEFAULT_API
+
+# multipart/form-data body for /api/v0/add, streamed from disk. entries are
+# (name, path) with path None for directories, or (name, file object).
+def multipart(entries, boundary):
+    for name, source in entries:
+        kind = "application/x-directory" if source is None else "application/octet-stream"
+        yield ("--%s\r\nContent-Disposition: form-data; name=\"file\"; filename=\"%s\"\r\nContent-Type: %s\r\n\r\n" % (boundary, quote(name, safe=""), kind)).encode("utf-8")
+        if isinstance(source, str):
+            with open(source, "rb") as f:
+                yield from iter(lambda: f.read(CHUNK_SIZE), b"")
+        elif source is not None:
+            yield from iter(lambda: source.read(CHUNK_SIZE), b"")
+        yield b"\r\n"
+    yield ("--%s--\r\n" % boundary).encode("utf-8")
+
+# The directory itself first, then what is in it depth-first, each subdirectory
+# followed by its own contents, the order go-ipfs-files sends them in. Names are
+# relative to the parent of path and dotfiles are left out, like ipfs add -r does.
+def directory_entries(path, hidden=False):
+    path = os.path.abspath(path)
+    yield from tree_entries(path, os.path.basename(path), hidden)
+
+def tree_entries(path, name, hidden):
+    yield name, None
+    for child in sorted(os.listdir(path), key=lambda child: child.encode("utf-8")):
+        if child.startswith(".") and not hidden:
+            continue
+        full = os.path.join(path, child)
+        if os.path.isdir(full):
+            yield from tree_entries(full, name + "/" + child, hidden)
+        elif os.path.isfile(full):
+            yield name + "/" + child, full
+
+# Extracts a tar from ipfs get into directory. Nothing may end up outside it: with
+# the data filter where tarfile has it, otherwise only plain files and directories
+# whose paths stay inside are accepted.
+def extract(tar, directory):
+    if hasattr(tarfile, "data_filter"):
+        tar.extractall(directory, filter="data")
+        return
+    root = os.path.realpath(directory)
+    for member in tar.getmembers():
+        target = os.path.realpath(os.path.join(root, member.name))
+        if not (member.isfile() or member.isdir()) or os.path.commonpath([root, target]) != root:
+            raise IpfsError("get: refusing to extract %s" % member.name)
+    tar.extractall(root)
+
+# Talks to a running daemon over its HTTP RPC API, one kept-alive connection for all calls
+class HttpApi:
+    def __init__(self, host, port, timeout=None):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.connection = None
+        self.lock = threading.Lock()
+
+    def request(self, command, args=(), body=None, headers=None, stream=False, **options):
+        query = [("arg", arg) for arg in args]
+        query += [(key.replace("_", "-"), str(value).lower() if isinstance(value, bool) else str(value)) for key, value in options.items()]
+        url = "/api/v0/" + command + ("?" + urlencode(query) if query else "")
+        with self.lock:
+            # a kept-alive connection may have been closed by the daemon, retry once if the body allows
+            for attempt in range(2):
+                if self.connection is None:
+                    self.connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+                try:
+                    self.connection.request("POST", url, body=body, headers=headers or {})
+                    response = self.connection.getresponse()
+                    data = response.read()
+                    break
+                except (http.client.HTTPException, OSError) as e:
+                    self.connection.close()
+                    self.connection = None
+                    # a daemon that didn't answer in time isn't asked again
+                    if attempt or isinstance(e, socket.timeout) or not (body is None or isinstance(body, bytes)):
+                        raise
+        if response.status != 200:
+            try:
+                message = json.loads(data.decode("utf-8")).get("Message")
+            except ValueError:
+                message = data.decode("utf-8", "replace")
+            raise IpfsError("%s: %s" % (command, message))
+        if stream:
+            return data
+        # most commands answer with one JSON object, some with one per line
+        return [json.loads(line) for line in data.decode("utf-8").splitlines() if line.strip()]
+
+    def reachable(self):
         try:
-            output = check_output(["ipfs", "add"], stdin=path).decode("ascii")
-        except CalledProcessError as err:
-            output = err.output
-    """
-    if pin:
+            self.request("version")
+            return True
+        except (IpfsError, OSError, http.client.HTTPException):
+            return False
+
+    def upload(self, entries, **options):
+        boundary = uuid.uuid4().hex
+        headers = {"Content-Type": "multipart/form-data; boundary=" + boundary}
+        return self.request("add", body=multipart(entries, boundary), headers=headers, **options)
+
+    def add(self, path, pin=True):
+        if type(path) == str:
+            entries = [(os.path.basename(path), path)]
+        else:
+            entries = [("file", path)]
+        return self.upload(entries, pin=pin)[-1]["Hash"]
+
+    def addRecursive(self, path):
+        return [entry["Hash"] for entry in self.upload(directory_entries(path)) if "Hash" in entry]
+
+    def cat(self, path):
+        return self.request("cat", [path], stream=True)
+
+    def get(self, path, directory="."):
+        data = self.request("get", [path], stream=True)
+        with tarfile.open(fileobj=io.BytesIO(data)) as tar:
+            extract(tar, directory)
+        return path
+
+    def publish(self, path, key=None):
+        options = {"key": key} if key else {}
+        return self.request("name/publish", [path], **options)[0]
+
+    def resolve(self, path):
+        return self.request("name/resolve", [path])[0]["Path"]
+
+    def ls(self, path):
+        return self.request("ls", [path])[0]["Objects"][0]["Links"]
+
+    def refs(self, path):
+        return [entry["Ref"] for entry in self.request("refs", [path]) if entry.get("Ref")]
+
+    def key_names(self):
+        return [key["Name"] for key in self.request("key/list")[0].get("Keys") or []]
+
+    def key_gen(self, name):
+        return self.request("key/gen", [name], type="ed25519")[0]
+
+    # True if all cids are pinned, directly or as part of a pinned DAG
+    def pinned(self, cids):
         try:
-            check_output(["ipfs", "pin", output.split(" ")[1]])
-        except CalledProcessError as err:
-            pass
-    """
-    return output.split(" ")[1]
+            self.request("pin/ls", cids, type="all")
+            return True
+        except IpfsError:
+            return False
+
+    def dag_import(self, car_path):
+        boundary = uuid.uuid4().hex
+        headers = {"Content-Type": "multipart/form-data; boundary=" + boundary}
+        return self.request("dag/import", body=multipart([(os.path.basename(car_path), car_path)], boundary), headers=headers, pin_roots=True)
+
+# The same calls through the ipfs executable, for when no API is reachable
+class Cli:
+    def json(self, *args):
+        output = check_output(["ipfs", "--enc=json"] + list(args)).decode("utf-8")
+        return [json.loads(line) for line in output.splitlines() if line.strip()]
+
+    def add(self, path, pin=True):
+        flags = ["-Q", "--pin=%s" % str(pin).lower()]
+        if type(path) == str:
+            output = check_output(["ipfs", "add"] + flags + [path])
+        else:
+            output = check_output(["ipfs", "add"] + flags, stdin=path)
+        return output.decode("ascii").strip()
+
+    def addRecursive(self, path):
+        # -q prints only the hashes, the root last, so file names can't get in the way
+        out = check_output(["ipfs", "add", "-r", "-q", path]).decode("utf-8")
+        return [line.strip() for line in out.split("\n") if line.strip()]
+
+    def cat(self, path):
+        return check_output(["ipfs", "cat", path])
+
+    def get(self, path, directory="."):
+        check_output(["ipfs", "get", path], stderr=DEVNULL, cwd=directory)
+        return path
+
+    def publish(self, path, key=None):
+        return self.json("name", "publish", *(["--key=" + key] if key else []), path)[0]
+
+    def resolve(self, path):
+        return self.json("name", "resolve", path)[0]["Path"]
+
+    def ls(self, path):
+        return self.json("ls", path)[0]["Objects"][0]["Links"]
+
+    def refs(self, path):
+        return [entry["Ref"] for entry in self.json("refs", path) if entry.get("Ref")]
+
+    def key_names(self):
+        return [key["Name"] for key in self.json("key", "list")[0].get("Keys") or []]
+
+    def key_gen(self, name):
+        return self.json("key", "gen", "--type=ed25519", name)[0]
+
+    def pinned(self, cids):
+        try:
+            check_output(["ipfs", "pin", "ls", "--type=all", "--"] + list(cids), stderr=DEVNULL)
+            return True
+        except CalledProcessError:
+            return False
+
+    def dag_import(self, car_path):
+        return self.json("dag", "import", "--pin-roots=true", car_path)
+
+# Starts at most one daemon per session, reuses one that is already running, and
+# only reports ready once the API answers. state is cheap to read from a panel.
+class Daemon:
+    def __init__(self):
+        self.process = None
+        self.state = "not started"
+        self.lock = threading.Lock()
+        self.ready = threading.Event()
+
+    def probe(self):
+        return HttpApi(*api_address(), timeout=2).reachable()
+
+    # returns at once, ready is set once the API answers
+    def start(self, timeout=READY_TIMEOUT):
+        with self.lock:
+            if self.process is not None and self.process.poll() is None and self.state == "starting":
+                return self.ready
+            if self.probe():
+                self.state = "running" if self.process is not None and self.process.poll() is None else "running (external)"
+                self.ready.set()
+                return self.ready
+            self.ready.clear()
+            try:
+                if not os.path.exists(os.path.join(repo_path(), "config")):
+                    init()
+                self.process = Popen(["ipfs", "daemon"], stdout=DEVNULL, stderr=DEVNULL)
+            except OSError as e:
+                self.state = "failed to start: %s" % e
+                return self.ready
+            self.state = "starting"
+            threading.Thread(target=self.watch, args=(self.process, timeout), daemon=True).start()
+            return self.ready
+
+    def watch(self, process, timeout):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline and process is self.process:
+            if process.poll() is not None:
+                self.state = "exited with %d" % process.returncode
+                return
+            if self.probe():
+                self.state = "running"
+                self.ready.set()
+                return
+            time.sleep(0.25)
+        if process is self.process:
+            self.state = "no API after %ds" % timeout
+
+    # gives up early once the daemon could not start or exited
+    def wait(self, timeout=READY_TIMEOUT):
+        ready = self.start(timeout)
+        deadline = time.monotonic() + timeout
+        while not ready.wait(0.25):
+            if self.state != "starting" or time.monotonic() > deadline:
+                return ready.is_set()
+        return True
+
+    # only a daemon started here is stopped, an external one keeps running
+    def stop(self):
+        with self.lock:
+            process, self.process = self.process, None
+            self.ready.clear()
+            self.state = "stopped"
+        if process is not None and process.poll() is None:
+            process.terminate()
+            try:
+                process.wait(10)
+            except TimeoutExpired:
+                process.kill()
+
+# Publishes to IPNS in a background thread, which can take minutes. Only the
+# newest root is published: a request made while one runs replaces any waiting one.
+class NamePublisher:
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.pending = None
+        self.busy = False
+        self.thread = None
+        self.state = "idle"
+        self.name = None
+
+    def submit(self, path, key=None):
+        with self.condition:
+            if self.pending is not None:
+                self.state = "skipping %s for a newer root" % self.pending[0]
+            self.pending = (path, key)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+
+    def done(self):
+        with self.condition:
+            return self.thread is None
+
+    def run(self):
+        while True:
+            with self.condition:
+                if self.pending is None:
+                    self.thread = None
+                    return
+                path, key = self.pending
+                self.pending = None
+                self.state = "publishing %s" % path
+            try:
+                # a connection of its own, the shared one would be blocked for the whole publish
+                client = cli if api() is cli else HttpApi(*api_address())
+                if key and key != "self" and key not in client.key_names():
+                    client.key_gen(key)
+                result = client.publish(path, key)
+                with self.condition:
+                    self.name = result["Name"]
+                    self.state = "published %s" % result["Value"]
+            except Exception as e:
+                with self.condition:
+                    self.state = "failed: %s" % e
+
+manager = Daemon()
+publisher = NamePublisher()
+cli = Cli()
+_api = None
+
+# The HTTP API once it has answered, the CLI until then and again once it stops answering
+def api():
+    global _api
+    if _api is None:
+        if not manager.probe():
+            return cli
+        _api = HttpApi(*api_address(), timeout=CALL_TIMEOUT)
+    return _api
+
+# Runs call(client) with api(). When it failed because the daemon went away or
+# hung, the HTTP API is forgotten and call is run once more, with the CLI after a
+# timeout and otherwise with what api() gives then.
+def with_api(call):
+    global _api
+    client = api()
+    try:
+        return call(client)
+    except (OSError, http.client.HTTPException) as e:
+        if client is cli:
+            raise
+        timed_out = isinstance(e, socket.timeout)
+        if not timed_out and manager.probe():
+            raise
+        if _api is client:
+            _api = None
+        return call(cli if timed_out else api())
+
+# True once a daemon's API answers, starting one if needed
+def start(timeout=READY_TIMEOUT):
+    return manager.wait(timeout)
+
+def add(path, pin=True):
+    # a file object is read again from where it was if the first try failed
+    start = None if type(path) == str else path.tell()
+    def call(client):
+        if start is not None:
+            path.seek(start)
+        return client.add(path, pin)
+    return with_api(call)
 
 def addRecursive(path):
-    out = check_output(["ipfs", "add", "-r", path]).decode("utf-8")
-    return [line.split(" ")[1] for line in out.split("\n") if len(line)>1]
-     
+    return with_api(lambda client: client.addRecursive(path))
+
 def cat(path):
-    check_output(["ipfs", "cat", path])
-  
-def get(path):
-    try:
-        output = check_output(["ipfs", "get", path], stderr=DEVNULL)
-    except CalledProcessError as err:
-        output = err.output
-    return output.split(" ")[-1].strip()
-    
-def publish(path):
-    return check_output(["ipfs", "name", "publish", path])
-    
+    return with_api(lambda client: client.cat(path))
+
+def get(path, directory="."):
+    return with_api(lambda client: client.get(path, directory))
+
+def publish(path, key=None):
+    return with_api(lambda client: client.publish(path, key))
+
 def resolve(path):
-    return check_output(["ipfs", "name", "resolve", path])
+    return with_api(lambda client: client.resolve(path))
 
 def ls(path):
-    return check_output(["ipfs", "ls", path])
-  
+    return with_api(lambda client: client.ls(path))
+
 def refs(path):
-    return check_output(["ipfs", "refs", path])
-    
+    return with_api(lambda client: client.refs(path))
+
+# The cids that are pinned, asked for in batches that are only halved where one
+# isn't, so a publish where nothing was collected takes one call instead of one per file
+def pinned_cids(client, cids, batch=500):
+    if len(cids) > batch:
+        return set().union(*(pinned_cids(client, cids[i:i+batch], batch) for i in range(0, len(cids), batch)))
+    if not cids or client.pinned(cids):
+        return set(cids)
+    if len(cids) == 1:
+        return set()
+    middle = len(cids) // 2
+    return pinned_cids(client, cids[:middle], batch) | pinned_cids(client, cids[middle:], batch)
+
+def load_published(state_path):
+    try:
+        with open(state_path, "r") as f:
+            return {digest: tuple(entry) for digest, entry in json.load(f).items()}
+    except (OSError, ValueError):
+        return {}
+
+# Adds a directory like addRecursive, but the files published from earlier
+# exports (by content, in state_path) are linked by their known CIDs instead of
+# being added again. Only the blocks of new files and the directory nodes go to
+# the daemon, as one CAR. Returns the root CID.
+def addIncremental(path, state_path):
+    return with_api(lambda client: add_incremental(client, path, state_path))
+
+def add_incremental(client, path, state_path):
+    known = load_published(state_path)
+    # the daemon may have collected files of earlier publishes since
+    cids = {digest: unixfs.cid_string(bytes.fromhex(entry[0])) for digest, entry in known.items()}
+    pinned = pinned_cids(client, sorted(set(cids.values())))
+    known = {digest: entry for digest, entry in known.items() if cids[digest] in pinned}
+    car_path = path.rstrip(os.sep) + ".publish.car"
+    try:
+        root = unixfs.add_path(path, car_path, known)
+        client.dag_import(car_path)
+    finally:
+        if os.path.exists(car_path):
+            os.remove(car_path)
+    with open(state_path + ".tmp", "w") as f:
+        json.dump(known, f)
+    os.replace(state_path + ".tmp", state_path)
+    return root
+
 def save(bytes):
     with TemporaryFile("wb+") as f:
         f.seek(0)
@@ -71,7 +488,7 @@ def save(bytes):
         f.flush()
         f.seek(0)
         return add(f)
-    
+
 def load(path):
     if os.path.isfile(path):
         with open(path, "rb+") as t:
@@ -87,7 +504,7 @@ def load(path):
         err = get(path)#tempdir
         with open(path,"rb+") as f:#~/.go-ipfs/datastore/"+
             d = f.read()
-        
+
     return d
-  
+
 #start()
@@ -0,0 +1,100 @@
+# Parallel gzip, no bpy in here
+# Works like pigz: the input is cut into blocks that are deflated on several threads
+# (zlib lets go of the GIL while it works), each primed with the 32KiB before it so
+# the ratio stays close to plain gzip. The blocks are joined into one ordinary gzip
+# member that gunzip and every browser read as usual.
+import os
+import zlib
+import struct
+import shutil
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+BLOCK_SIZE = 128*1024
+DICT_SIZE = 32*1024
+default_level = 9
+
+# threads for workers=0, one per core
+def cpu_count():
+	return os.cpu_count() or 1
+
+# raw deflate of one block; all but the last end on a byte boundary without
+# closing the stream, so the blocks can simply be put one after another
+def deflate_block(data, dictionary, level, last):
+	if dictionary:
+		compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS, zlib.DEF_MEM_LEVEL, zlib.Z_DEFAULT_STRATEGY, dictionary)
+	else:
+		compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+	return compressor.compress(data) + compressor.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+# A write-only file object that gzips into fileobj. No more than two blocks per
+# worker are in flight, and output is written in order as blocks finish. The header
+# has no file name and mtime 0 unless given one, so equal input gives equal output.
+class GzipWriter:
+	def __init__(self, fileobj, level=default_level, workers=0, mtime=0):
+		self.fileobj = fileobj
+		self.level = level
+		self.workers = workers or cpu_count()
+		self.pool = None
+		self.pending = deque()
+		self.buffer = bytearray()
+		self.previous = b""
+		self.crc = 0
+		self.size = 0
+		self.closed = False
+		fileobj.write(b"\x1f\x8b\x08\x00" + struct.pack("<I", int(mtime)) + b"\x00\xff")
+
+	def writable(self):
+		return True
+
+	def write(self, data):
+		self.crc = zlib.crc32(data, self.crc)
+		self.size += len(data)
+		self.buffer += data
+		# the last block is only known on close, so one always stays behind
+		while len(self.buffer) > BLOCK_SIZE:
+			block = bytes(self.buffer[:BLOCK_SIZE])
+			del self.buffer[:BLOCK_SIZE]
+			self.submit(block, False)
+		return len(data)
+
+	def submit(self, block, last):
+		dictionary = self.previous
+		self.previous = block[-DICT_SIZE:]
+		# small files and single threads gain nothing from the pool
+		if self.workers == 1 or (last and not self.pending):
+			self.fileobj.write(deflate_block(block, dictionary, self.level, last))
+			return
+		if self.pool is None:
+			self.pool = ThreadPoolExecutor(max_workers=self.workers)
+		self.pending.append(self.pool.submit(deflate_block, block, dictionary, self.level, last))
+		while self.pending and (len(self.pending) > 2*self.workers or self.pending[0].done()):
+			self.fileobj.write(self.pending.popleft().result())
+
+	def flush(self):
+		pass
+
+	def close(self):
+		if self.closed:
+			return
+		self.closed = True
+		try:
+			self.submit(bytes(self.buffer), True)
+			while self.pending:
+				self.fileobj.write(self.pending.popleft().result())
+			self.fileobj.write(struct.pack("<II", self.crc & 0xffffffff, self.size & 0xffffffff))
+		finally:
+			self.buffer = bytearray()
+			if self.pool is not None:
+				self.pool.shutdown(wait=False)
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+def compress_file(in_path, out_path, level=default_level, workers=0):
+	with open(in_path, "rb") as f_in, open(out_path, "wb") as f_out:
+		with GzipWriter(f_out, level, workers) as gz:
+			shutil.copyfileobj(f_in, gz, BLOCK_SIZE)
@@ -0,0 +1,199 @@
+# Serves an export directory to JanusVR over HTTP, no bpy in here
+# Files are sent with strong ETags (a hash of their content) and Cache-Control: no-cache,
+# so JanusVR revalidates every file and gets a 304 for those that didn't change.
+# Range requests are answered. A request for x finds x.gz as well, which is then sent
+# as is with Content-Encoding: gzip to clients that accept it, and gunzipped on the
+# way out to the others.
+import os
+import re
+import gzip
+import threading
+import mimetypes
+from email.utils import formatdate
+from hashlib import sha256
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, unquote, quote
+
+default_port = 8321
+CHUNK_SIZE = 256*1024
+byte_range = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+class PreviewServer(ThreadingHTTPServer):
+	daemon_threads = True
+
+	def __init__(self, address, root):
+		ThreadingHTTPServer.__init__(self, address, PreviewHandler)
+		self.root = root
+		self.lock = threading.Lock()
+		self.etags = {}
+		self.sizes = {}
+
+	# ETags are kept until the file's size or modification time changes
+	def etag(self, path):
+		stat = os.stat(path)
+		key = (stat.st_mtime_ns, stat.st_size)
+		with self.lock:
+			cached = self.etags.get(path)
+		if cached and cached[0] == key:
+			return cached[1], stat
+		digest = sha256()
+		with open(path, "rb") as f:
+			for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+				digest.update(chunk)
+		etag = '"%s"' % digest.hexdigest()[:32]
+		with self.lock:
+			self.etags[path] = (key, etag)
+		return etag, stat
+
+	# size of a .gz file's content, kept like the ETags
+	def gunzipped_size(self, path, stat):
+		key = (stat.st_mtime_ns, stat.st_size)
+		with self.lock:
+			cached = self.sizes.get(path)
+		if cached and cached[0] == key:
+			return cached[1]
+		size = 0
+		with gzip.open(path, "rb") as f:
+			for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+				size += len(chunk)
+		with self.lock:
+			self.sizes[path] = (key, size)
+		return size
+
+	def switch(self, root):
+		with self.lock:
+			self.root = root
+			self.etags = {}
+			self.sizes = {}
+
+class PreviewHandler(BaseHTTPRequestHandler):
+	protocol_version = "HTTP/1.1"
+
+	def log_message(self, format, *args):
+		pass
+
+	# the file a request is for, never outside the served directory
+	def local_path(self):
+		path = unquote(urlsplit(self.path).path)
+		parts = [p for p in path.replace("\\", "/").split("/") if p not in ("", ".", "..")]
+		if not parts or path.endswith("/"):
+			parts.append("index.html")
+		return os.path.join(self.server.root, *parts)
+
+	def do_GET(self):
+		self.respond(True)
+
+	def do_HEAD(self):
+		self.respond(False)
+
+	def send_empty(self, status, headers=()):
+		self.send_response(status)
+		for key, value in headers:
+			self.send_header(key, value)
+		self.send_header("Content-Length", "0")
+		self.end_headers()
+
+	def respond(self, body):
+		path = self.local_path()
+		served = path
+		encoding = None
+		gunzip = False
+		if not os.path.isfile(path) and os.path.isfile(path+".gz"):
+			served = path+".gz"
+			if "gzip" in self.headers.get("Accept-Encoding", ""):
+				encoding = "gzip"
+			else:
+				gunzip = True
+		if not os.path.isfile(served):
+			self.send_empty(404)
+			return
+		etag, stat = self.server.etag(served)
+		size = stat.st_size
+		if gunzip:
+			# another representation, so another ETag
+			etag = etag[:-1] + '-gunzip"'
+			size = self.server.gunzipped_size(served, stat)
+		kind, kind_encoding = mimetypes.guess_type(path)
+		if kind_encoding == "gzip" and encoding is None:
+			kind = "application/gzip"
+		headers = [("ETag", etag), ("Last-Modified", formatdate(stat.st_mtime, usegmt=True)), ("Cache-Control", "no-cache"), ("Accept-Ranges", "bytes")]
+		if encoding:
+			headers.append(("Content-Encoding", encoding))
+		if served != path:
+			headers.append(("Vary", "Accept-Encoding"))
+		matches = [tag.strip() for tag in self.headers.get("If-None-Match", "").split(",")]
+		if etag in matches or "*" in matches:
+			self.send_empty(304, headers)
+			return
+		start, end = 0, size - 1
+		status = 200
+		requested = byte_range.match(self.headers.get("Range", "").strip())
+		# a Range only holds for the version If-Range names, otherwise the whole file goes out
+		if requested and self.headers.get("If-Range", etag) == etag and any(requested.groups()):
+			first, last = requested.groups()
+			if not first:
+				start = max(0, size - int(last))
+			else:
+				start = int(first)
+				end = min(int(last), size - 1) if last else size - 1
+			if start > end:
+				self.send_empty(416, headers + [("Content-Range", "bytes */%d" % size)])
+				return
+			status = 206
+			headers.append(("Content-Range", "bytes %d-%d/%d" % (start, end, size)))
+		self.send_response(status)
+		self.send_header("Content-Type", kind or "application/octet-stream")
+		self.send_header("Content-Length", str(end - start + 1))
+		for key, value in headers:
+			self.send_header(key, value)
+		self.end_headers()
+		if not body:
+			return
+		# seeking in a gzip file reads up to there, which is fine for the odd Range
+		with (gzip.open(served, "rb") if gunzip else open(served, "rb")) as f:
+			f.seek(start)
+			remaining = end - start + 1
+			while remaining > 0:
+				chunk = f.read(min(CHUNK_SIZE, remaining))
+				if not chunk:
+					break
+				self.wfile.write(chunk)
+				remaining -= len(chunk)
+
+# One server for the session, pointed at the newest export each time a room is launched
+class Preview:
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.server = None
+
+	def serve(self, root, port=default_port):
+		with self.lock:
+			if self.server is not None and port in (0, self.server.server_address[1]):
+				self.server.switch(root)
+			else:
+				self.close()
+				self.server = PreviewServer(("127.0.0.1", port), root)
+				threading.Thread(target=self.server.serve_forever, daemon=True).start()
+			return self.url()
+
+	def url(self, name="index.html"):
+		return "http://127.0.0.1:%d/%s" % (self.server.server_address[1], quote(name))
+
+	def close(self):
+		if self.server is not None:
+			self.server.shutdown()
+			self.server.server_close()
+			self.server = None
+
+	def stop(self):
+		with self.lock:
+			self.close()
+
+	@property
+	def state(self):
+		with self.lock:
+			if self.server is None:
+				return "stopped"
+			return "serving %s on port %d" % (os.path.basename(self.server.root), self.server.server_address[1])
+
+preview = Preview()
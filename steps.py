@@ -0,0 +1,25 @@
+# Generators of short main-thread steps, shared by the import and the export, no bpy in here
+# A step yields None to give the UI a turn, or the future of worker-thread work it
+# has to wait for. The modal operators run a slice of steps per timer tick, scripts
+# run them to the end in one go.
+import time
+from concurrent.futures import wait
+
+# seconds of steps per timer tick
+time_slice = 0.05
+
+# Runs steps for up to budget seconds, returns False once they are done
+def run_slice(steps, budget=None):
+	deadline = time.perf_counter() + (budget or time_slice)
+	for waiting in steps:
+		if waiting is not None and not waiting.done():
+			return True
+		if time.perf_counter() >= deadline:
+			return True
+	return False
+
+# Runs steps to the end, blocking on the futures instead of polling them
+def run_all(steps):
+	for waiting in steps:
+		if waiting is not None:
+			wait([waiting])
@@ -0,0 +1,180 @@
+# UnixFS/dag-pb hashing without a daemon, no bpy in here.
+# Produces the same CIDv0 as `ipfs add -r` with its defaults: 256KiB chunks,
+# balanced layout with at most 174 links per node, no raw leaves, hidden files
+# skipped. Directories are never sharded, which go-ipfs only does past ~256KiB
+# of directory entries. Blocks can be written to a CARv1 archive on the way.
+import os
+import shutil
+from hashlib import sha256
+
+CHUNK_SIZE = 262144
+MAX_LINKS = 174
+# UnixFS Data.Type
+DIRECTORY = 1
+FILE = 2
+
+B58_ALPHABET = b"123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz"
+
+def b58encode(data):
+	n = int.from_bytes(data, "big")
+	out = bytearray()
+	while n:
+		n, r = divmod(n, 58)
+		out.append(B58_ALPHABET[r])
+	out.extend(b"1" * (len(data) - len(data.lstrip(b"\0"))))
+	return bytes(reversed(out)).decode("ascii")
+
+def varint(n):
+	out = bytearray()
+	while n > 0x7f:
+		out.append((n & 0x7f) | 0x80)
+		n >>= 7
+	out.append(n)
+	return bytes(out)
+
+# protobuf field helpers, wire type 0 (varint) and 2 (length delimited)
+def pb_varint(field, value):
+	return varint(field << 3) + varint(value)
+
+def pb_bytes(field, value):
+	return varint(field << 3 | 2) + varint(len(value)) + value
+
+def unixfs_data(kind, data=None, filesize=None, blocksizes=()):
+	out = pb_varint(1, kind)
+	if data:
+		out += pb_bytes(2, data)
+	if filesize is not None:
+		out += pb_varint(3, filesize)
+	for size in blocksizes:
+		out += pb_varint(4, size)
+	return out
+
+# PBNode with the links first, as dag-pb serialises them; links are (multihash, name, tsize)
+def pb_node(links, data):
+	out = b""
+	for multihash, name, tsize in links:
+		link = pb_bytes(1, multihash) + pb_bytes(2, name.encode("utf-8")) + pb_varint(3, tsize)
+		out += pb_bytes(2, link)
+	return out + pb_bytes(1, data)
+
+def multihash(block):
+	return b"\x12\x20" + sha256(block).digest()
+
+def cid_string(multihash):
+	return b58encode(multihash)
+
+# A built node: its multihash, cumulative size (for the parent's link) and file data size
+class Node:
+	def __init__(self, multihash, tsize, filesize):
+		self.multihash = multihash
+		self.tsize = tsize
+		self.filesize = filesize
+
+def file_digest(path):
+	digest = sha256()
+	with open(path, "rb") as f:
+		for chunk in iter(lambda: f.read(1024*1024), b""):
+			digest.update(chunk)
+	return digest.hexdigest()
+
+class Builder:
+	# on_block(multihash, block) sees every block once, e.g. to write a CAR.
+	# known maps sha256 hex digests of whole files to (multihash hex, tsize, filesize)
+	# of files that were built before, those are neither rebuilt nor passed to on_block.
+	def __init__(self, on_block=None, known=None):
+		self.on_block = on_block
+		self.known = known
+		self.used = set()
+		self.seen = set()
+
+	def emit(self, block, tsize, filesize):
+		node = Node(multihash(block), tsize, filesize)
+		if self.on_block is not None and node.multihash not in self.seen:
+			self.seen.add(node.multihash)
+			self.on_block(node.multihash, block)
+		return node
+
+	def leaf(self, chunk):
+		block = pb_node([], unixfs_data(FILE, chunk, len(chunk)))
+		return self.emit(block, len(block), len(chunk))
+
+	def parent(self, children):
+		filesize = sum(child.filesize for child in children)
+		block = pb_node([(child.multihash, "", child.tsize) for child in children], unixfs_data(FILE, filesize=filesize, blocksizes=[child.filesize for child in children]))
+		return self.emit(block, len(block) + sum(child.tsize for child in children), filesize)
+
+	# all leaves at the same depth, filled left to right
+	def add_stream(self, f):
+		level = []
+		while True:
+			chunk = f.read(CHUNK_SIZE)
+			if not chunk and level:
+				break
+			level.append(self.leaf(chunk))
+			if not chunk:
+				break
+		while len(level) > 1:
+			level = [self.parent(level[i:i+MAX_LINKS]) for i in range(0, len(level), MAX_LINKS)]
+		return level[0]
+
+	def add_file(self, path):
+		if self.known is None:
+			with open(path, "rb") as f:
+				return self.add_stream(f)
+		digest = file_digest(path)
+		self.used.add(digest)
+		if digest in self.known:
+			hexhash, tsize, filesize = self.known[digest]
+			return Node(bytes.fromhex(hexhash), tsize, filesize)
+		with open(path, "rb") as f:
+			node = self.add_stream(f)
+		self.known[digest] = (node.multihash.hex(), node.tsize, node.filesize)
+		return node
+
+	def add_directory(self, path, hidden=False):
+		links = []
+		for name in sorted(os.listdir(path), key=lambda name: name.encode("utf-8")):
+			if name.startswith(".") and not hidden:
+				continue
+			child = os.path.join(path, name)
+			if os.path.isdir(child):
+				node = self.add_directory(child, hidden)
+			elif os.path.isfile(child):
+				node = self.add_file(child)
+			else:
+				continue
+			links.append((node.multihash, name, node.tsize))
+		block = pb_node(links, unixfs_data(DIRECTORY))
+		return self.emit(block, len(block) + sum(tsize for _, _, tsize in links), 0)
+
+# CARv1 header: dag-cbor {"roots": [CID], "version": 1}, CIDs as tag 42
+def car_header(root):
+	cid = b"\x00" + root
+	header = b"\xa2" + b"\x65roots" + b"\x81\xd8\x2a" + b"\x58" + bytes([len(cid)]) + cid + b"\x67version\x01"
+	return varint(len(header)) + header
+
+# Hashes a directory (or a file) like ipfs add -r and returns the root CID,
+# writing its blocks to car_path as well if given. With known (see Builder) the
+# files in it are skipped, new ones are recorded there and absent ones dropped.
+def add_path(path, car_path=None, known=None):
+	def build(builder):
+		root = builder.add_directory(path) if os.path.isdir(path) else builder.add_file(path)
+		if known is not None:
+			for digest in set(known) - builder.used:
+				del known[digest]
+		return root
+	if car_path is None:
+		return cid_string(build(Builder(known=known)).multihash)
+	# the header needs the root, so the blocks go to a side file first
+	blocks_path = car_path + ".blocks"
+	with open(blocks_path, "wb") as blocks:
+		def write_block(multihash, block):
+			blocks.write(varint(len(multihash) + len(block)) + multihash + block)
+		root = build(Builder(write_block, known))
+	with open(car_path + ".part", "wb") as car:
+		car.write(car_header(root.multihash))
+		with open(blocks_path, "rb") as blocks:
+			shutil.copyfileobj(blocks, car)
+	os.remove(blocks_path)
+	os.replace(car_path + ".part", car_path)
+	return cid_string(root.multihash)
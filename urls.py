@@ -0,0 +1,100 @@
+# URL handling for the importer, no bpy in here
+# Room, asset and texture references are all resolved to one canonical URL form,
+# so the same resource always gets the same cache key no matter how it was written.
+import os
+import re
+import posixpath
+from functools import lru_cache
+from urllib.parse import urlsplit, urlunsplit, urljoin, quote, unquote
+from urllib.request import url2pathname, pathname2url
+
+default_ports = {"http": 80, "https": 443}
+# the schemes canonical touches, others (ipfs:, data:, ...) may be case-sensitive and are kept as written
+canonical_schemes = ("", "http", "https", "file")
+drive_path = re.compile(r"^/?[a-zA-Z]:/")
+# characters left alone when quoting paths, existing escapes are normalized first
+path_safe = "/:@!$&'()*+,;=~%"
+escape = re.compile(r"%([0-9A-Fa-f]{2})")
+stray_percent = re.compile(r"%(?![0-9A-Fa-f]{2})")
+unreserved = frozenset("ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-._~")
+
+# Escapes of unreserved characters decoded, all others kept (%2F stays %2F, not a new
+# path segment) with uppercase hex, and whatever isn't allowed in a path quoted
+def normalize_escapes(path):
+	def unescape(match):
+		c = chr(int(match.group(1), 16))
+		return c if c in unreserved else "%" + match.group(1).upper()
+	path = escape.sub(unescape, stray_percent.sub("%25", path))
+	return quote(path, safe=path_safe)
+
+# Filesystem paths (with backslashes or drive letters) and URLs to a URL, a "%" in
+# a path is part of a file name
+@lru_cache(maxsize=None)
+def to_url(path):
+	path = path.replace("\\", "/")
+	if drive_path.match(path):
+		return "file:///" + quote(path.lstrip("/"), safe="/:")
+	if path.startswith("/"):
+		return "file://" + quote(path, safe="/:")
+	return path
+
+# Lowercase scheme and host, no default port or fragment, dot segments removed and
+# the path quoted the same way every time. file: urls always come out as file:///path.
+# Urls of other schemes are returned unchanged.
+@lru_cache(maxsize=None)
+def canonical(url):
+	url = to_url(url)
+	parts = urlsplit(url)
+	scheme = parts.scheme.lower()
+	if scheme not in canonical_schemes:
+		return url
+	path = parts.path
+	trailing = path.endswith("/") or path.endswith("/.") or path.endswith("/..")
+	if path:
+		path = posixpath.normpath("/" + path.lstrip("/"))
+		if trailing and path != "/":
+			path += "/"
+	path = normalize_escapes(path)
+	if scheme == "file":
+		return urlunsplit(("file", "", path, "", ""))
+	netloc = parts.hostname or ""
+	if parts.port and parts.port != default_ports.get(scheme):
+		netloc += ":%d" % parts.port
+	if parts.username:
+		netloc = parts.username + (":" + parts.password if parts.password else "") + "@" + netloc
+	return urlunsplit((scheme, netloc, path or "/", parts.query, ""))
+
+# ref as seen from the directory base, both may be paths or URLs
+@lru_cache(maxsize=None)
+def resolve(base, ref):
+	ref = ref.replace("\\", "/")
+	if drive_path.match(ref) or urlsplit(ref).scheme in ("http", "https", "file"):
+		return canonical(ref)
+	base = canonical(base)
+	if not base.endswith("/"):
+		base += "/"
+	return canonical(urljoin(base, ref))
+
+# the directory of a url, ending with /
+def directory(url):
+	return urljoin(canonical(url), ".")
+
+def is_local(url):
+	return url.startswith("file:")
+
+# local path of a file: url
+def local_path(url):
+	return os.path.abspath(url2pathname(urlsplit(canonical(url)).path))
+
+def file_url(path):
+	return canonical("file:" + pathname2url(os.path.abspath(path)))
+
+# last path segment of a url, unquoted
+def basename(url):
+	return unquote(posixpath.basename(urlsplit(url).path))
+
+# resolved urls are kept per room, a new room starts from scratch
+def reset():
+	to_url.cache_clear()
+	canonical.cache_clear()
+	resolve.cache_clear()
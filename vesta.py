@@ -0,0 +1,447 @@
+# Uploads to Vesta, no bpy in here
+# The room goes up as a tar.gz that is compressed while it is being sent: no
+# archive is written to disk and only QUEUE_CHUNKS chunks are held in memory.
+# Large rooms are split into several such parts, queued on disk and retried.
+import os
+import io
+import re
+import json
+import uuid
+import queue
+import gzip
+import tarfile
+import threading
+import http.client
+from urllib.parse import urlsplit, unquote
+from hashlib import sha256
+
+from . import pargzip, gltf
+
+CHUNK_SIZE = 256*1024
+QUEUE_CHUNKS = 8
+upload_timeout = 60
+manifest_name = "vesta_manifest.json"
+queue_name = "vesta_queue.json"
+# uncompressed bytes of files per uploaded part, a file larger than that gets a part of its own
+part_size = 8*1024*1024
+# seconds between attempts at a part, giving up after the last
+retry_delays = (2, 5, 15, 30, 60)
+# times a job is started over before it is given up for good
+max_attempts = 3
+# the room itself, uploaded every time
+index_name = "index.html"
+mtl_texture = re.compile(r"^\s*(?:map_\w+|bump|disp|refl)\s.*?(\S+)\s*$", re.MULTILINE)
+asset_reference = re.compile(r'\b(src|vertex_src|mtl|tex)="([^"]*)"')
+
+class UploadError(Exception):
+	def __init__(self, message, status=None):
+		Exception.__init__(self, message)
+		self.status = status
+
+	# server errors and broken connections are worth another try, a refused request isn't
+	def retryable(self):
+		return self.status is None or self.status >= 500
+
+# The end of the pipe tarfile writes into, passing full chunks on to a bounded queue
+# so the archiver waits for the upload instead of running ahead of it
+class ChunkPipe(io.RawIOBase):
+	def __init__(self, chunks, stopped):
+		self.chunks = chunks
+		self.stopped = stopped
+		self.buffer = bytearray()
+
+	def writable(self):
+		return True
+
+	def put(self, item):
+		while not self.stopped.is_set():
+			try:
+				self.chunks.put(item, timeout=0.1)
+				return
+			except queue.Full:
+				pass
+		raise UploadError("Upload stopped")
+
+	def write(self, data):
+		self.buffer += data
+		while len(self.buffer) >= CHUNK_SIZE:
+			self.put(bytes(self.buffer[:CHUNK_SIZE]))
+			del self.buffer[:CHUNK_SIZE]
+		return len(data)
+
+	def finish(self):
+		if self.buffer:
+			self.put(bytes(self.buffer))
+			self.buffer = bytearray()
+		self.put(None)
+
+# Counts what tarfile reads from the files, the upload's progress before compression
+class CountingReader:
+	def __init__(self, f, count):
+		self.f = f
+		self.count = count
+
+	def read(self, size=-1):
+		data = self.f.read(size)
+		self.count(len(data))
+		return data
+
+# the files of an export directory that go into the archive, not earlier archives
+def archive_names(directory):
+	return sorted(f for f in os.listdir(directory) if os.path.isfile(os.path.join(directory, f)) and not f.endswith(".tar.gz"))
+
+# Chunks of a tar.gz of names in directory, compressed in a thread while they are consumed.
+# read(n) is called with the uncompressed bytes taken from the files so far.
+def archive_chunks(directory, names, read=None, level=pargzip.default_level, workers=0):
+	chunks = queue.Queue(QUEUE_CHUNKS)
+	stopped = threading.Event()
+	def produce():
+		pipe = ChunkPipe(chunks, stopped)
+		try:
+			with pargzip.GzipWriter(pipe, level, workers) as gz:
+				with tarfile.open(fileobj=gz, mode="w|") as tar:
+					for name in names:
+						path = os.path.join(directory, name)
+						info = tar.gettarinfo(path, arcname=name)
+						with open(path, "rb") as f:
+							tar.addfile(info, CountingReader(f, read) if read else f)
+			pipe.finish()
+		except Exception as e:
+			if not stopped.is_set():
+				pipe.put(e)
+	threading.Thread(target=produce, daemon=True).start()
+	try:
+		while True:
+			chunk = chunks.get()
+			if chunk is None:
+				return
+			if isinstance(chunk, Exception):
+				raise chunk
+			yield chunk
+	finally:
+		stopped.set()
+
+def form_field(boundary, name, value):
+	return ("--%s\r\nContent-Disposition: form-data; name=\"%s\"\r\n\r\n%s\r\n" % (boundary, name, value)).encode("utf-8")
+
+# multipart/form-data with the fields first and the file last, as the file's size isn't known
+def multipart(fields, filename, chunks, boundary):
+	for name, value in fields:
+		yield form_field(boundary, name, value)
+	yield ("--%s\r\nContent-Disposition: form-data; name=\"file\"; filename=\"%s\"\r\nContent-Type: application/gzip\r\n\r\n" % (boundary, filename)).encode("utf-8")
+	yield from chunks
+	yield ("\r\n--%s--\r\n" % boundary).encode("utf-8")
+
+# POSTs an iterable body with chunked transfer encoding, sent(n) sees the bytes sent so far
+def post_chunked(url, body, headers, sent=None, timeout=upload_timeout):
+	parts = urlsplit(url)
+	connection_class = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+	connection = connection_class(parts.hostname, parts.port, timeout=timeout)
+	def counted():
+		total = 0
+		for chunk in body:
+			total += len(chunk)
+			if sent:
+				sent(total)
+			yield chunk
+	try:
+		connection.request("POST", (parts.path or "/") + ("?" + parts.query if parts.query else ""), body=counted(), headers=headers, encode_chunked=True)
+		response = connection.getresponse()
+		return response.status, response.read()
+	finally:
+		connection.close()
+
+# Streams the export directory to Vesta's upload endpoint. progress(read, total, sent)
+# gets the uncompressed bytes archived out of total and the bytes sent.
+def upload_directory(url, directory, fields, filename, progress=None, names=None, level=pargzip.default_level, workers=0):
+	names = archive_names(directory) if names is None else names
+	total = sum(os.path.getsize(os.path.join(directory, name)) for name in names)
+	state = {"read": 0, "sent": 0}
+	def read(n):
+		state["read"] += n
+	def sent(n):
+		state["sent"] = n
+		if progress:
+			progress(state["read"], total, n)
+	boundary = uuid.uuid4().hex
+	body = multipart(fields, filename, archive_chunks(directory, names, read, level, workers), boundary)
+	status, data = post_chunked(url, body, {"Content-Type": "multipart/form-data; boundary=" + boundary}, sent)
+	if status != 200:
+		raise UploadError("%d %s" % (status, data[:200].decode("utf-8", "replace")), status)
+	return data
+
+def post_json(url, data, timeout=upload_timeout):
+	parts = urlsplit(url)
+	connection_class = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+	connection = connection_class(parts.hostname, parts.port, timeout=timeout)
+	try:
+		connection.request("POST", (parts.path or "/") + ("?" + parts.query if parts.query else ""), body=json.dumps(data).encode("utf-8"))
+		response = connection.getresponse()
+		body = response.read()
+	finally:
+		connection.close()
+	if response.status != 200:
+		raise UploadError("%d %s" % (response.status, body[:200].decode("utf-8", "replace")), response.status)
+	return json.loads(body.decode("utf-8"))
+
+# names split into parts of about part_size, index.html in the last one
+def split_parts(directory, names):
+	parts = [[]]
+	size = 0
+	for name in sorted(names, key=lambda name: name == index_name):
+		file_size = os.path.getsize(os.path.join(directory, name))
+		if parts[-1] and size + file_size > part_size:
+			parts.append([])
+			size = 0
+		parts[-1].append(name)
+		size += file_size
+	return parts
+
+def read_content(directory, name):
+	path = os.path.join(directory, name)
+	return gzip.open(path, "rb") if name.endswith(".gz") else open(path, "rb")
+
+# the files among names each .mtl and .gltf(.gz) refers to, relative to itself:
+# textures of materials, buffers and images of glTF
+def file_dependencies(directory, names):
+	dependencies = {}
+	for name in names:
+		lower = name.lower()
+		if lower.endswith(".mtl"):
+			with open(os.path.join(directory, name), "r", encoding="utf-8", errors="replace") as f:
+				found = mtl_texture.findall(f.read())
+		elif lower.endswith(".gltf") or lower.endswith(".gltf.gz"):
+			try:
+				with read_content(directory, name) as f:
+					found = [unquote(uri) for _, _, uri in gltf.external_uris(json.loads(f.read().decode("utf-8")))]
+			except (OSError, ValueError):
+				found = []
+		else:
+			continue
+		dependencies[name] = sorted(set(d for d in found if d in names and d != name))
+	return dependencies
+
+# sha256 of each file's content, of .gz files uncompressed so how they were compressed
+# doesn't matter. Those of .mtl and glTF also cover their dependencies, so a changed
+# texture or buffer gets the file referring to it uploaded again next to it.
+def content_digests(directory, names, dependencies):
+	digests = {}
+	for name in names:
+		digest = sha256()
+		with read_content(directory, name) as f:
+			for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+				digest.update(chunk)
+		digests[name] = digest.hexdigest()
+	for name, used in dependencies.items():
+		digests[name] = sha256(" ".join([digests[name]] + [digests[d] for d in used]).encode("ascii")).hexdigest()
+	return digests
+
+# Uploads recorded per Vesta files path: "name digest" -> url the file was uploaded to
+def load_manifest(path):
+	try:
+		with open(path, "r", encoding="utf-8") as f:
+			return json.load(f)
+	except (OSError, ValueError):
+		return {}
+
+def save_manifest(path, manifest):
+	with open(path+".tmp", "w", encoding="utf-8") as f:
+		json.dump(manifest, f, indent=1, sort_keys=True)
+	os.replace(path+".tmp", path)
+
+def upload_key(name, digest):
+	return name + " " + digest
+
+# The names that have to go up and the urls of those uploaded before with the same content.
+# A material or glTF going up takes its dependencies along, it finds them next to itself.
+def plan_upload(names, digests, dependencies, uploaded):
+	reuse = {}
+	for name in names:
+		url = uploaded.get(upload_key(name, digests[name]))
+		if url and name != index_name:
+			reuse[name] = url
+	for name, used in dependencies.items():
+		if name not in reuse:
+			for dependency in used:
+				reuse.pop(dependency, None)
+	return [name for name in names if name not in reuse], reuse
+
+# Points the room's asset references to files in the export at base_url, or at
+# their earlier upload for those in reuse. The export has to be written without a base path.
+def relink(directory, names, base_url, reuse):
+	names = set(names)
+	def link(match):
+		key, value = match.groups()
+		if value not in names:
+			return match.group(0)
+		return '%s="%s"' % (key, reuse.get(value, base_url + value))
+	path = os.path.join(directory, index_name)
+	with open(path, "r", encoding="utf-8") as f:
+		html = f.read()
+	with open(path, "w", encoding="utf-8", newline="\n") as f:
+		f.write(asset_reference.sub(link, html))
+
+def record_upload(uploaded, names, digests, base_url):
+	for name in names:
+		if name != index_name:
+			uploaded[upload_key(name, digests[name])] = base_url + name
+
+# Uploads queued exports one part at a time in a background thread. The queue is
+# saved to state_path after every finished part, so an interrupted upload carries
+# on with the parts it still lacks, also after a restart. A job is a dict:
+#   directory, upload_url, fields, timestamp, parts, done: the parts and which went up
+#   create_url, room: the room creation request sent once all parts are up
+#   manifest, files_path, remote_path, digests, upload: recorded in the manifest at the end
+#   attempts: runs of the job that failed
+# The login token is not part of it, so it never ends up in the saved queue. It is
+# given to start() and added to the fields and the room request when they are sent.
+# A job that can't be retried, or failed max_attempts times, is finished with its error.
+class Uploader:
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.stopped = threading.Event()
+		self.thread = None
+		self.state_path = None
+		self.token = None
+		self.jobs = []
+		self.state = "idle"
+		self.sent = 0
+		self.fraction = 0.0
+		self.finished = []
+
+	def load(self, state_path):
+		with self.lock:
+			if self.thread is not None or state_path == self.state_path:
+				return
+			self.state_path = state_path
+			try:
+				with open(state_path, "r", encoding="utf-8") as f:
+					self.jobs = json.load(f)
+			except (OSError, ValueError):
+				self.jobs = []
+			# queues saved by earlier versions had the token in them, it goes with the next save
+			for job in self.jobs:
+				job["fields"] = [field for field in job["fields"] if field[0] != "token"]
+				job["room"].pop("token", None)
+			if self.jobs:
+				self.state = "%d uploads waiting" % len(self.jobs)
+
+	def save(self):
+		with self.lock:
+			jobs = json.dumps(self.jobs, indent=1)
+		with open(self.state_path+".tmp", "w", encoding="utf-8") as f:
+			f.write(jobs)
+		os.replace(self.state_path+".tmp", self.state_path)
+
+	def submit(self, state_path, job, token):
+		self.load(state_path)
+		with self.lock:
+			self.jobs.append(job)
+		self.save()
+		self.start(token)
+
+	def start(self, token=None):
+		with self.lock:
+			if token:
+				self.token = token
+			if self.thread is not None or not self.jobs:
+				return
+			self.stopped.clear()
+			self.thread = threading.Thread(target=self.run, daemon=True)
+			self.thread.start()
+
+	# the current part is abandoned, it starts over on the next start()
+	def stop(self):
+		self.stopped.set()
+
+	def running(self):
+		with self.lock:
+			return self.thread is not None
+
+	def waiting(self):
+		with self.lock:
+			return len(self.jobs)
+
+	# jobs finished since the last call, as (job, room creation response), the
+	# response being {"error": True, "message": ...} for a job that was given up
+	def take_finished(self):
+		with self.lock:
+			finished, self.finished = self.finished, []
+			return finished
+
+	def run(self):
+		try:
+			while not self.stopped.is_set():
+				with self.lock:
+					if not self.jobs:
+						self.state = "idle"
+						return
+					job = self.jobs[0]
+				try:
+					response = self.run_job(job)
+				except Exception as e:
+					if self.stopped.is_set():
+						return
+					with self.lock:
+						job["attempts"] = job.get("attempts", 0) + 1
+						given_up = job["attempts"] >= max_attempts or (isinstance(e, UploadError) and not e.retryable())
+					if not given_up:
+						# most likely the connection, the job is tried again on the next start()
+						self.save()
+						raise
+					response = {"error": True, "message": str(e)}
+				with self.lock:
+					self.jobs.pop(0)
+					self.finished.append((job, response))
+				self.save()
+		except Exception as e:
+			self.state = "failed: %s, %d uploads waiting" % (e, self.waiting())
+		finally:
+			with self.lock:
+				self.thread = None
+			if self.stopped.is_set():
+				self.state = "stopped, %d uploads waiting" % self.waiting()
+
+	def run_job(self, job):
+		parts = job["parts"]
+		for index, names in enumerate(parts):
+			if index in job["done"]:
+				continue
+			self.upload_part(job, index, names)
+			with self.lock:
+				job["done"].append(index)
+			self.save()
+		self.state = "creating room"
+		response = post_json(job["create_url"], dict(job["room"], token=self.token))
+		if response.get("error") == False:
+			manifest = load_manifest(job["manifest"])
+			record_upload(manifest.setdefault(job["files_path"], {}), job["upload"], job["digests"], job["remote_path"])
+			save_manifest(job["manifest"], manifest)
+		return response
+
+	def upload_part(self, job, index, names):
+		if not self.token:
+			raise UploadError("No VESTA token", 401)
+		fields = [["token", self.token]] + job["fields"]
+		parts = len(job["parts"])
+		def progress(read, total, sent):
+			if self.stopped.is_set():
+				raise UploadError("Upload stopped")
+			self.sent = sent
+			self.fraction = (index + (read / total if total else 1)) / parts
+			self.state = "part %d/%d, %.1f MB sent" % (index+1, parts, sent / 1048576)
+		filename = "vesta_%s_%d.tar.gz" % (job["timestamp"], index)
+		for delay in retry_delays + (None,):
+			try:
+				upload_directory(job["upload_url"], job["directory"], fields, filename, progress, names, job.get("gzip_level", pargzip.default_level), job.get("gzip_threads", 0))
+				return
+			except (UploadError, OSError, http.client.HTTPException) as e:
+				if self.stopped.is_set():
+					raise UploadError("Upload stopped")
+				if delay is None or (isinstance(e, UploadError) and not e.retryable()):
+					raise
+				self.state = "part %d/%d failed (%s), retrying in %ds" % (index+1, parts, e, delay)
+				if self.stopped.wait(delay):
+					raise UploadError("Upload stopped")
+
+uploader = Uploader()
@@ -1,14 +1,18 @@
 import os
 import io
 import shutil
-import gzip
+import json
+import threading
 from contextlib import redirect_stdout
+from concurrent.futures import ThreadPoolExecutor
+from xml.sax.saxutils import escape
 
 import bpy
 from mathutils import Vector, Quaternion
 
 from .html import Tag
 from . import ipfs
+from . import urls, unixfs, pargzip, steps
 
 # boolean to string
 def b2s(b):
@@ -83,12 +87,51 @@ def mtm(attr, m):
 		attr += [("ydir", p2s(list(m @ Vector([0,0,1,0]))[:3]))]
 		attr += [("zdir", p2s(list(m @ Vector([0,-1,0,0]))[:3]))]
 
-def gzip_compress(in_path, out_path):
-	with open(in_path,'rb') as f_in:
-		with gzip.open(out_path,'wb') as f_out:
-			shutil.copyfileobj(f_in, f_out)
-	
-def write_html(scene, filepath, path_mode, base_path=''):
+def gzip_compress(in_path, out_path, level=pargzip.default_level, workers=0):
+	pargzip.compress_file(in_path, out_path, level, workers)
+
+# compresses an exported file next to itself and drops the original
+def gzip_replace(path, level=pargzip.default_level, workers=0):
+	gzip_compress(path, path+'.gz', level, workers)
+	os.remove(path)
+
+# copies and compression need no bpy, they run here while the next objects are exported
+export_workers = 4
+
+# What the export operator shows while it runs, jobs finish in worker threads
+class ExportProgress:
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.reset(0)
+
+	def reset(self, objects):
+		self.stage = "Exporting objects"
+		self.objects = objects
+		self.objects_done = 0
+		self.jobs = 0
+		self.jobs_done = 0
+		self.cid = None
+
+	def add_job(self, job):
+		with self.lock:
+			self.jobs += 1
+		job.add_done_callback(self.job_done)
+
+	def job_done(self, job):
+		with self.lock:
+			self.jobs_done += 1
+
+	def fraction(self):
+		total = self.objects + self.jobs
+		return (self.objects_done + self.jobs_done) / total if total else 0.0
+
+	def text(self):
+		return "%s: %d/%d objects, %d/%d files" % (self.stage, self.objects_done, self.objects, self.jobs_done, self.jobs)
+
+progress = ExportProgress()
+
+# Builds the room one object per step, handing file work to background(fn, *args)
+def build_room(scene, filepath, path_mode, base_path, background):
 
 	stdout = io.StringIO()
 
@@ -165,7 +208,7 @@ def write_html(scene, filepath, path_mode, base_path=''):
 			assetimage = Tag("AssetImage", attr=[("id",sky[1]), ("src",base_path+skyname)])
 			if not assetimage in assets:
 				assets(assetimage)
-				shutil.copyfile(src=bpy.path.abspath(sky[0]), dst=os.path.join(filepath, skyname))
+				background(shutil.copyfile, bpy.path.abspath(sky[0]), os.path.join(filepath, skyname))
 
 	if scene.janus_room_light_probes_active:
 		attr += [
@@ -178,7 +221,7 @@ def write_html(scene, filepath, path_mode, base_path=''):
 			assetimage = Tag("AssetImage", attr=[("id",sky[1]), ("src",base_path+skyname)])
 			if not assetimage in assets:
 				assets(assetimage)
-				shutil.copyfile(src=bpy.path.abspath(sky[0]), dst=os.path.join(filepath, skyname))
+				background(shutil.copyfile, bpy.path.abspath(sky[0]), os.path.join(filepath, skyname))
 		
 	if scene.janus_room_script_active:
 		script_list = [scene.janus_room_script1,scene.janus_room_script2,scene.janus_room_script3,scene.janus_room_script4]
@@ -188,7 +231,7 @@ def write_html(scene, filepath, path_mode, base_path=''):
 				assetscript = Tag("AssetScript", attr=[("src",base_path+scriptname)])
 				if not assetscript in assets:
 					assets(assetscript)
-					shutil.copyfile(src=bpy.path.abspath(script_entry), dst=os.path.join(filepath, scriptname))
+					background(shutil.copyfile, bpy.path.abspath(script_entry), os.path.join(filepath, scriptname))
 
 	if scene.janus_room_shader_active:
 		if scene.janus_room_shader_frag != "":
@@ -203,9 +246,9 @@ def write_html(scene, filepath, path_mode, base_path=''):
 		if not assetshader in assets:
 			assets(assetshader)
 			if fragname:
-				shutil.copyfile(src=bpy.path.abspath(scene.janus_room_shader_frag), dst=os.path.join(filepath, fragname))
+				background(shutil.copyfile, bpy.path.abspath(scene.janus_room_shader_frag), os.path.join(filepath, fragname))
 			if vertname:
-				shutil.copyfile(src=bpy.path.abspath(scene.janus_room_shader_vert), dst=os.path.join(filepath, vertname))
+				background(shutil.copyfile, bpy.path.abspath(scene.janus_room_shader_vert), os.path.join(filepath, vertname))
 
 	room = Tag("Room", attr)
 
@@ -218,6 +261,7 @@ def write_html(scene, filepath, path_mode, base_path=''):
 
 	exportedmeshes = []
 	exportedsurfaces = []
+	exportedproxyassets = []
 
 	if  scene.janus_unpack:
 		bpy.ops.file.make_paths_relative()
@@ -291,8 +335,7 @@ def write_html(scene, filepath, path_mode, base_path=''):
 					if scene.janus_object_export == '.obj':
 						with redirect_stdout(stdout):
 							bpy.ops.export_scene.obj(filepath=epath, use_selection=True, use_smooth_groups_bitflags=True, use_uvs=True, use_materials=True, use_mesh_modifiers=True,use_triangles=True, check_existing=False, use_normals=True, path_mode="COPY", axis_forward='-Z', axis_up='Y')
-							gzip_compress(epath, epath+'.gz')
-							os.remove(epath)
+							background(gzip_replace, epath, scene.janus_gzip_level, scene.janus_gzip_threads)
 					elif scene.janus_object_export == '.dae':
 						with redirect_stdout(stdout):
 							# TODO differentiate between per-object and per-mesh properties
@@ -300,13 +343,11 @@ def write_html(scene, filepath, path_mode, base_path=''):
 								bpy.ops.wm.collada_export(filepath=epath, selected=True, check_existing=False, export_texture_type_selection='mat', apply_modifiers=True)
 							else:
 								bpy.ops.wm.collada_export(filepath=epath, selected=True, check_existing=False, apply_modifiers=True)
-							gzip_compress(epath, epath+'.gz')
-							os.remove(epath)
+							background(gzip_replace, epath, scene.janus_gzip_level, scene.janus_gzip_threads)
 					elif scene.janus_object_export == '.gltf':
 						with redirect_stdout(stdout):
 							bpy.ops.export_scene.gltf(export_format='GLTF_SEPARATE', export_selected=True, export_apply=True, filepath=epath)
-							gzip_compress(epath, epath+'.gz')
-							os.remove(epath)
+							background(gzip_replace, epath, scene.janus_gzip_level, scene.janus_gzip_threads)
 					if scene.janus_object_export==".obj":
 						ob = Tag("AssetObject", attr=[("id", o.data.name), ("src",base_path+o.data.name+scene.janus_object_export+'.gz'), ("mtl",base_path+o.data.name+".mtl")])
 					else:
@@ -353,9 +394,9 @@ def write_html(scene, filepath, path_mode, base_path=''):
 						assetshader = Tag("AssetShader", attr=[("id",fragname),("src",base_path+fragname),("vertex_src",base_path+vertname)])
 						if not assetshader in assets:
 								assets(assetshader)
-								shutil.copyfile(src=bpy.path.abspath(o.janus_object_shader_frag), dst=os.path.join(filepath, fragname))
+								background(shutil.copyfile, bpy.path.abspath(o.janus_object_shader_frag), os.path.join(filepath, fragname))
 								if vertname != "":
-									shutil.copyfile(src=bpy.path.abspath(o.janus_object_shader_vert), dst=os.path.join(filepath, vertname))
+									background(shutil.copyfile, bpy.path.abspath(o.janus_object_shader_vert), os.path.join(filepath, vertname))
 						attr += [("shader_id", fragname)]
 
 				room(Tag("Object", single=False, attr=attr))
@@ -401,14 +442,36 @@ def write_html(scene, filepath, path_mode, base_path=''):
 				assetsound = Tag("AssetSound", attr=[("id", name), ("src",base_path+name)])
 				if not assetsound in assets:
 					assets(assetsound)
-					shutil.copyfile(src=bpy.path.abspath(o.janus_object_sound), dst=os.path.join(filepath, name))
+					background(shutil.copyfile, bpy.path.abspath(o.janus_object_sound), os.path.join(filepath, name))
 				sound = Tag("Sound", attr=[("id", name), ("js_id", o.janus_object_jsid), ("pos", p2s(o.location)), ("dist", f2s(o.janus_object_sound_dist)), ("rect", v2s(list(o.janus_object_sound_xy1)+list(o.janus_object_sound_xy2))), ("loop", b2s(o.janus_object_sound_loop)), ("play_once", b2s(o.janus_object_sound_once))])
 				room(sound)
+		elif o.type=="EMPTY" and "janus_object" in o:
+			# placeholder from a lazy import, written back from its original attributes
+			# so untouched objects need no geometry at all
+			attr = json.loads(o["janus_object"])
+			placement = list(o.location) + list(o.rotation_euler) + list(o.scale)
+			if any(abs(a-b) > 1e-5 for a, b in zip(placement, o.get("janus_placement", placement))):
+				for key in ("pos", "scale", "fwd", "xdir", "ydir", "zdir", "rotation"):
+					attr.pop(key, None)
+				moved = [("pos", p2s(o.location)), ("scale", lp2s(o.scale))]
+				mtm(moved, o.matrix_local)
+				attr.update(moved)
+			if "janus_asset" in o:
+				assetattr = json.loads(o["janus_asset"])
+				if assetattr.get("id") not in exportedproxyassets:
+					for key in ("src", "mtl"):
+						if assetattr.get(key):
+							assetattr[key] = urls.resolve(o["janus_basepath"], assetattr[key])
+					assets(Tag("AssetObject", attr=[(k, escape(v, {'"': "&quot;"})) for k, v in assetattr.items()]))
+					exportedproxyassets.append(assetattr.get("id"))
+			room(Tag("Object", single=False, attr=[(k, escape(str(v), {'"': "&quot;"})) for k, v in attr.items()]))
 		elif o.type == 'LAMP':
 			print(o.data.distance)
 			print(o.janus_object_jsid)
 			light = Tag("Light", attr=[("js_id", o.janus_object_jsid), ("col", v2s(o.data.color[:3])), ("pos", p2s(o.location)), ("light_range", f2s(o.data.distance*2.0)), ("light_exponent", f2s(o.data.distance)), ("light_intensity", f2s(o.data.energy*5.0)) ])
 			room(light)
+		progress.objects_done += 1
+		yield
 	
 	if bpy.app.version < (2, 80):
 		for so in bpy.context.selected_objects:
@@ -428,10 +491,64 @@ def write_html(scene, filepath, path_mode, base_path=''):
 	fire(assets)
 	fire(room)
 	body(fire)
-	file = open(os.path.join(filepath,"index.html"), mode="w", encoding="utf8", newline="\n")
-	fw = file.write
-	doc.write(fw, indent="")
-	file.close()
+	return doc
+
+# The export as a sequence of short main-thread steps, yielding the job it waits for
+# once only copies and compression are left. index.html is written last, so closing
+# the generator early never leaves a room that looks complete.
+def export_steps(scene, filepath, path_mode, base_path=''):
+	progress.reset(len(bpy.data.objects))
+	pool = ThreadPoolExecutor(max_workers=export_workers)
+	jobs = []
+	started = set()
+	def background(fn, *args):
+		# the same file may be copied for several assets, e.g. one image on all skybox sides
+		if (fn, args) in started:
+			return
+		started.add((fn, args))
+		job = pool.submit(fn, *args)
+		progress.add_job(job)
+		jobs.append(job)
+	userselect = bpy.context.selected_objects[:]
+	try:
+		doc = yield from build_room(scene, filepath, path_mode, base_path, background)
+		progress.stage = "Writing files"
+		for job in jobs:
+			while not job.done():
+				yield job
+			job.result()
+		file = open(os.path.join(filepath,"index.html"), mode="w", encoding="utf8", newline="\n")
+		fw = file.write
+		doc.write(fw, indent="")
+		file.close()
+		if scene.janus_ipfs:
+			# the root CID ipfs add -r will give the directory, known without a daemon
+			progress.stage = "Hashing"
+			car_path = filepath.rstrip(os.sep) + ".car" if scene.janus_ipfs_car else None
+			hashing = pool.submit(unixfs.add_path, filepath, car_path)
+			while not hashing.done():
+				yield hashing
+			progress.cid = hashing.result()
+	except GeneratorExit:
+		for job in jobs:
+			job.cancel()
+		# build_room only restores the selection once it gets to the end
+		for so in bpy.context.selected_objects:
+			if bpy.app.version < (2, 80):
+				so.select = False
+			else:
+				so.select_set(state=False)
+		for so in userselect:
+			if bpy.app.version < (2, 80):
+				so.select = True
+			else:
+				so.select_set(state=True)
+		raise
+	finally:
+		pool.shutdown(wait=False)
+
+def write_html(scene, filepath, path_mode, base_path=''):
+	steps.run_all(export_steps(scene, filepath, path_mode, base_path))
 
 def save(operator, context, filepath="", path_mode="AUTO", relpath="", base_path=''):
 	write_html(context.scene, filepath, path_mode, base_path=base_path)
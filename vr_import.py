@@ -6,14 +6,33 @@ import bpy
 from mathutils import Vector, Matrix, Euler
 from math import radians
 import re
-import bs4
 import traceback
+import threading
+import heapq
+import itertools
 import sys
 import json
+import time
 from hashlib import md5 as hashlib_md5
+from concurrent.futures import ThreadPoolExecutor, Future
+from . import gltf, wavefront, firebox, urls, steps
 current_module = sys.modules[__name__]
-primitive_path = 'file:///'+os.path.join(os.path.dirname(current_module.__file__), 'primitives')
+primitive_path = urls.file_url(os.path.join(os.path.dirname(current_module.__file__), 'primitives'))
 primitives = ['capsule', 'cone', 'cube', 'cylinder', 'pipe', 'plane', 'pyramid', 'sphere', 'torus']
+# how far into an .obj to look for mtllib before giving up
+mtllib_scan_bytes = 64*1024
+# statements after which no mtllib is expected anymore
+obj_geometry_statements = (b'v', b'vt', b'vn', b'vp', b'f', b'l', b'p')
+# parallel downloads for the dependencies of a single asset
+fetch_workers = 8
+# build .obj meshes directly instead of going through bpy.ops.import_scene.obj
+native_obj_import = True
+# objects are fetched and instantiated in rings of this width around the import origin
+proximity_band = 10.0
+# seconds until reading the room page gives up on a silent server
+page_timeout = 30
+# parsed rooms are kept in this directory of the working path
+room_cache_dir = "rooms"
 def s2v(s):
 	try:
 		return [float(c) for c in s.split(" ")]
@@ -50,12 +69,226 @@ def fromFwd(v):
 def neg(v):
 	return [-e for e in v]
 
-def rel2abs(base, path):
-	if path.startswith("../"):
-		parentdir = base[:-2 if base.endswith("/") else -1].rsplit("/", 1)[0]
-		return os.path.join(parentdir, path[3:])
+retrieve_locks = {}
+retrieve_locks_guard = threading.Lock()
 
-	return path
+# Assets load in parallel and may share files, only one of them may write a target
+def retrieve_lock(target):
+	with retrieve_locks_guard:
+		return retrieve_locks.setdefault(target, threading.Lock())
+
+# Scan the header of an .obj for its mtllib, stopping at the first geometry statement
+def find_mtllib(path, limit=None):
+	if limit is None:
+		limit = mtllib_scan_bytes
+	scanned = 0
+	with open(path, 'rb') as f:
+		for line in f:
+			scanned += len(line)
+			words = line.split(None, 1)
+			if words:
+				if words[0] == b'mtllib' and len(words) > 1:
+					return words[1].strip().decode('utf-8', 'replace')
+				if words[0] in obj_geometry_statements:
+					break
+			if scanned >= limit:
+				break
+	return None
+
+def link_objects(objects):
+	if bpy.app.version < (2, 80):
+		for obj in objects:
+			bpy.context.scene.objects.link(obj)
+	else:
+		collection = bpy.context.collection
+		for obj in objects:
+			collection.objects.link(obj)
+	tracker.add(objects)
+
+def build_material(name, props, texture_dir):
+	mat = bpy.data.materials.new(name)
+	color = tuple(props.get("Kd", (0.8, 0.8, 0.8)))
+	alpha = props.get("d", 1.0)
+	mat.diffuse_color = color + (alpha,)
+	mat.use_nodes = True
+	bsdf = mat.node_tree.nodes.get("Principled BSDF")
+	if bsdf is None:
+		return mat
+	bsdf.inputs["Base Color"].default_value = color + (1.0,)
+	if alpha < 1.0:
+		bsdf.inputs["Alpha"].default_value = alpha
+		if hasattr(mat, "blend_method"):
+			mat.blend_method = 'BLEND'
+	texture = props.get("map_Kd")
+	if texture:
+		path = os.path.join(texture_dir, texture)
+		if os.path.exists(path):
+			node = mat.node_tree.nodes.new("ShaderNodeTexImage")
+			node.image = bpy.data.images.load(path, check_existing=True)
+			mat.node_tree.links.new(node.outputs["Color"], bsdf.inputs["Base Color"])
+	return mat
+
+def build_mesh(group, materials):
+	mesh = bpy.data.meshes.new(group["name"])
+	mesh.vertices.add(len(group["positions"]))
+	mesh.vertices.foreach_set("co", group["positions"].ravel())
+	mesh.loops.add(len(group["loop_vertices"]))
+	mesh.loops.foreach_set("vertex_index", group["loop_vertices"])
+	mesh.polygons.add(len(group["face_sizes"]))
+	mesh.polygons.foreach_set("loop_start", group["face_starts"])
+	try:
+		mesh.polygons.foreach_set("loop_total", group["face_sizes"])
+	except (AttributeError, TypeError, RuntimeError):
+		# read-only where face sizes are derived from loop_start
+		pass
+	mesh.polygons.foreach_set("use_smooth", group["face_smooth"])
+	mesh.polygons.foreach_set("material_index", group["face_materials"])
+	if group["loop_uvs"] is not None:
+		mesh.uv_layers.new().data.foreach_set("uv", group["loop_uvs"].ravel())
+	for name in group["materials"]:
+		mesh.materials.append(materials.get(name))
+	normals = group.get("loop_normals")
+	if normals is None:
+		mesh.validate()
+		mesh.update()
+		return mesh
+	# custom split normals as the bpy OBJ importer sets them, validate must keep the loops
+	mesh.validate(clean_customdata=False)
+	mesh.update()
+	if len(mesh.loops) == len(normals):
+		if hasattr(mesh, "use_auto_smooth"):
+			mesh.use_auto_smooth = True
+		mesh.normals_split_custom_set(normals.tolist())
+	return mesh
+
+# Creates objects from a wavefront.parse_obj result, already converted to Z up
+def build_obj(parsed, mtl=None):
+	materials = {}
+	if mtl:
+		for name, props in wavefront.parse_mtl(mtl).items():
+			materials[name] = build_material(name, props, os.path.dirname(mtl))
+	objects = [bpy.data.objects.new(group["name"], build_mesh(group, materials)) for group in parsed["groups"]]
+	link_objects(objects)
+	return objects
+
+# Finds the objects each importer adds without scanning the whole scene per asset.
+# Importers select what they create, the object count tells whether that can be trusted.
+class ObjectTracker:
+	def __init__(self):
+		self.reset()
+
+	def reset(self):
+		self.known = None
+		self.count = 0
+
+	def begin(self):
+		if self.known is None:
+			self.known = {o.as_pointer() for o in bpy.data.objects}
+		self.count = len(bpy.data.objects)
+
+	def add(self, objects):
+		if self.known is not None:
+			self.known.update(o.as_pointer() for o in objects)
+
+	def new_objects(self):
+		added = len(bpy.data.objects) - self.count
+		objects = [o for o in bpy.context.selected_objects if o.as_pointer() not in self.known]
+		if len(objects) != added:
+			objects = [o for o in bpy.data.objects if o.as_pointer() not in self.known]
+		self.add(objects)
+		self.count = len(bpy.data.objects)
+		return objects
+
+	# deletes an object and forgets its pointer, which the next new object may get
+	def remove(self, obj):
+		if self.known is not None:
+			self.known.discard(obj.as_pointer())
+		bpy.data.objects.remove(obj, do_unlink=True)
+
+	# drops pointers of objects that were joined away, they may be reused
+	def joined(self, pointers, survivors):
+		self.known.difference_update(set(pointers) - {o.as_pointer() for o in survivors})
+		self.count = len(bpy.data.objects)
+
+tracker = ObjectTracker()
+
+class ImportCancelled(Exception):
+	pass
+
+# What the import operator shows while it runs, the counters are written from worker threads
+class ImportProgress:
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.reset()
+
+	def reset(self):
+		self.cancelled = threading.Event()
+		self.stage = "Reading room"
+		self.bytes = 0
+		self.assets = 0
+		self.assets_done = 0
+
+	def add_bytes(self, count):
+		with self.lock:
+			self.bytes += count
+
+	def asset_done(self):
+		with self.lock:
+			self.assets_done += 1
+
+	def fraction(self):
+		return self.assets_done / self.assets if self.assets else 0.0
+
+	def text(self):
+		return "%s: %d/%d assets, %.1f MB" % (self.stage, self.assets_done, self.assets, self.bytes / (1024*1024))
+
+progress = ImportProgress()
+
+# A urlretrieve reporthook counting what arrived, which stops the download once the
+# import it belongs to is cancelled. Every import has its own cancelled event, so
+# downloads left over from a cancelled one don't carry on when the next one starts.
+def download_hook(cancelled):
+	counted = 0
+	def hook(blocks, block_size, total_size):
+		nonlocal counted
+		if cancelled.is_set():
+			raise ImportCancelled()
+		# called once with 0 blocks before anything arrived, the last block may be short
+		received = blocks * block_size
+		if total_size > 0:
+			received = min(received, total_size)
+		progress.add_bytes(received - counted)
+		counted = received
+	return hook
+
+# Runs fn in a daemon thread, so a hung server can't keep Blender from quitting
+def run_in_thread(fn, *args):
+	future = Future()
+	def run():
+		if future.set_running_or_notify_cancel():
+			try:
+				future.set_result(fn(*args))
+			except BaseException as e:
+				future.set_exception(e)
+	threading.Thread(target=run, daemon=True).start()
+	return future
+
+# Stand-in for an <AssetObject> tag of assets that are not declared in the room
+def asset_tag(id, src):
+	return firebox.Element("assetobject", {"id": id, "src": src})
+
+# Downloads the .obj assets and parses them all at once, in worker threads if there are many
+def preparse_obj_assets(assets):
+	if not native_obj_import or bpy.app.version < (2, 80):
+		return
+	for asset in assets:
+		try:
+			asset.load()
+		except:
+			print(traceback.format_exc())
+	assets = [asset for asset in assets if asset.loaded and asset.src and asset.parsed is None]
+	for asset, parsed in zip(assets, wavefront.parse_many([asset.src for asset in assets])):
+		asset.parsed = parsed
 
 class AssetObjectObj:
 
@@ -72,20 +305,13 @@ class AssetObjectObj:
 		self.loaded = False
 		self.imported = False
 		self.objects = []
+		self.parsed = None
+		# the cancelled event of the import this asset is loaded for
+		self.cancelled = progress.cancelled
 
+	# canonical url of path as seen from the directory base, which may be relative to the room
 	def abs_source(self, base, path):
-		base = rel2abs(self.basepath, base)
-		if path.startswith("file:///"):
-			path = path
-		if path.startswith("./"):
-			path = path[2:]
-		if path.startswith("/") or path.startswith("http://") or path.startswith("https://"):
-			return path
-		elif path.startswith("../"):
-			return rel2abs(base, path)
-		if base.startswith("http://") or base.startswith("https://"):
-			return os.path.join(base, path).replace('\\','/')
-		return os.path.join(base, path).replace('\\','/')
+		return urls.resolve(urls.resolve(self.basepath, base), path)
 	
 	def md5(self, url):
 		m = hashlib_md5()
@@ -94,7 +320,8 @@ class AssetObjectObj:
 	
 	def abs_target(self, path, source=None):
 		if source:
-			name, ext = os.path.splitext(os.path.basename(path))
+			# keyed by the canonical url, however the reference was written
+			name, ext = os.path.splitext(urls.basename(source))
 			if ext == '.gz':
 				_, ext = os.path.splitext(os.path.basename(name))
 				ext += '.gz'
@@ -106,31 +333,56 @@ class AssetObjectObj:
 		exists = True
 		if base is None:
 			base = self.basepath
-		if path.startswith('file:///'):
-			return os.path.abspath(path[8:]), exists
+		if urls.is_local(path):
+			return urls.local_path(path), exists
 		source = self.abs_source(base, path)
 		target = self.abs_target(path, source=source)
-		if not os.path.exists(os.path.abspath(target)):
-			exists = False
-			print('Retrieving '+source, 'to', target)
-			try:
-				urlreq.urlretrieve(source, target)
-			except:
-				print('Error getting '+source)
-				print(traceback.format_exc())
-				return '', exists
-		else:
-			print('Reusing '+source, 'as', target)
-		if path.endswith(".gz"):
-			if not os.path.exists(target[:-3]):
+		with retrieve_lock(target):
+			if not os.path.exists(os.path.abspath(target)):
 				exists = False
-				with gzip.open(target, 'rb') as infile:
-					with open(target[:-3], 'wb') as outfile:
-						outfile.write(infile.read())
+				print('Retrieving '+source, 'to', target)
+				try:
+					# never leave a partial file another asset could mistake for a finished one
+					urlreq.urlretrieve(source, target+'.part', download_hook(self.cancelled))
+					os.replace(target+'.part', target)
+				except ImportCancelled:
+					return '', exists
+				except:
+					print('Error getting '+source)
+					print(traceback.format_exc())
+					return '', exists
+			else:
+				print('Reusing '+source, 'as', target)
+			if path.endswith(".gz"):
+				if not os.path.exists(target[:-3]):
+					exists = False
+					with gzip.open(target, 'rb') as infile:
+						with open(target[:-3]+'.part', 'wb') as outfile:
+							outfile.write(infile.read())
+					os.replace(target[:-3]+'.part', target[:-3])
 
-			return target[:-3], exists
+				return target[:-3], exists
 		return target, exists
 
+	# size of the downloaded main file, used to schedule small assets first
+	def size(self):
+		try:
+			return os.path.getsize(self.src)
+		except (OSError, TypeError):
+			return 0
+
+	# Retrieves several resources at once, results are in the same order as paths
+	def retrieve_all(self, paths, base=None):
+		unique = list(dict.fromkeys(paths))
+		if len(unique) < 2:
+			results = [self.retrieve(path, base) for path in unique]
+		else:
+			# duplicates were dropped, so no two workers write the same target
+			with ThreadPoolExecutor(max_workers=min(fetch_workers, len(unique))) as pool:
+				results = list(pool.map(lambda path: self.retrieve(path, base), unique))
+		results = dict(zip(unique, results))
+		return [results[path] for path in paths]
+
 	def load(self):
 
 		if self.loaded:
@@ -141,17 +393,16 @@ class AssetObjectObj:
 			exists = False
 			local = False
 			if self.mtl is None:
-				with open(self.src,'r') as f:
-					mtllib = re.search(r"mtllib (.*?)$", f.read(), re.MULTILINE)
-					if mtllib:
-						try:
-							self.mtl_basepath = self.abs_source( os.path.dirname(self.abs_source(self.basepath, self.tag["src"])), mtllib.group(1))
-							self.mtl, exists = self.retrieve(self.mtl_basepath)
-							if self.mtl:
-								local = True
-						except Exception as e:
-							print(e)
-							self.mtl = None
+				mtllib = find_mtllib(self.src) if self.src else None
+				if mtllib:
+					try:
+						self.mtl_basepath = self.abs_source( os.path.dirname(self.abs_source(self.basepath, self.tag["src"])), mtllib)
+						self.mtl, exists = self.retrieve(self.mtl_basepath)
+						if self.mtl:
+							local = True
+					except Exception as e:
+						print(e)
+						self.mtl = None
 			if self.mtl is not None:
 				if self.mtl_basepath:
 					mtlpath = os.path.dirname(self.mtl_basepath)
@@ -180,54 +431,240 @@ class AssetObjectObj:
 						mtlfile.write(file)
 			self.loaded = True
 			print('Loaded asset.')
+	# the imported objects may have been deleted since, e.g. between lazy loads
+	def objects_valid(self):
+		try:
+			for obj in self.objects:
+				obj.name
+		except ReferenceError:
+			return False
+		return True
+
 	#An .obj can include multiple objects!
 	def instantiate(self, tag):
+		if self.imported and not self.objects_valid():
+			self.imported = False
 		if not self.imported:
-			#bpy.ops.object.select_all(action='DESELECT')
 			self.load()
 			self.imported = True
-			objects = list(bpy.data.objects)
-			if self.mtl is not None:
-				if self.mtl[:-4] != self.src[:-4]:
-					# rewrite obj to use correct mtl
-					replaced = False
-					file = ""
-					with open(self.abs_target(self.src, source=self.orig_src), "r") as mtlfile:
-						for line in mtlfile.read().split('\n'):
-							if line[:6] == 'mtllib':
-								file = file + 'mtllib ' + os.path.basename(self.mtl) + '\n'
-								replaced = True
-							else:
-								file = file + line + '\n'
-						if replaced == False:
-							file = 'mtllib ' + os.path.basename(self.mtl) + '\n' + file
-					with open(self.abs_target(self.src[:-4]+"_"+os.path.basename(self.mtl[:-4])+".obj"), "w") as mtlfile:
-						mtlfile.write(file)
-					bpy.ops.import_scene.obj(filepath=self.src[:-4]+"_"+os.path.basename(self.mtl[:-4])+".obj", axis_up="Y", axis_forward="-Z")
-				else:
-					bpy.ops.import_scene.obj(filepath=self.src, axis_up="Y", axis_forward="-Z")
+			self.objects = self.import_asset()
+			objects = self.objects
+		else:
+			objects = self.copy_objects()
+			link_objects(objects)
+		place(objects, tag)
+		return list(objects)
+
+	# Imports once, then makes linked copies for the other tags and links them in one go
+	def instantiate_many(self, tags):
+		instances = [self.instantiate(tags[0])]
+		copies = []
+		for tag in tags[1:]:
+			objects = self.copy_objects()
+			place(objects, tag)
+			copies.extend(objects)
+			instances.append(objects)
+		link_objects(copies)
+		return instances
+
+	# Linked duplicates of the imported objects, like duplicate(linked=True) without the operator
+	def copy_objects(self):
+		copies = {obj.as_pointer(): obj.copy() for obj in self.objects}
+		for copy in copies.values():
+			if copy.parent is not None and copy.parent.as_pointer() in copies:
+				copy.parent = copies[copy.parent.as_pointer()]
+		return list(copies.values())
+
+	def import_asset(self):
+		objects = None
+		if native_obj_import and bpy.app.version >= (2, 80):
+			try:
+				objects = self.import_native()
+			except:
+				print(traceback.format_exc())
+		if objects is None:
+			objects = self.import_operator()
+		if objects:
+			objects[0].name = self.id
+		return objects
+
+	def import_native(self):
+		parsed = self.parsed
+		self.parsed = None
+		if parsed is None:
+			parsed = wavefront.parse_obj(self.src)
+		mtl = self.mtl if self.mtl and os.path.exists(self.mtl) else None
+		return build_obj(parsed, mtl)
+
+	def import_operator(self):
+		bpy.ops.object.select_all(action='DESELECT')
+		tracker.begin()
+		if self.mtl is not None:
+			if self.mtl[:-4] != self.src[:-4]:
+				# rewrite obj to use correct mtl
+				replaced = False
+				file = ""
+				with open(self.abs_target(self.src, source=self.orig_src), "r") as mtlfile:
+					for line in mtlfile.read().split('\n'):
+						if line[:6] == 'mtllib':
+							file = file + 'mtllib ' + os.path.basename(self.mtl) + '\n'
+							replaced = True
+						else:
+							file = file + line + '\n'
+					if replaced == False:
+						file = 'mtllib ' + os.path.basename(self.mtl) + '\n' + file
+				with open(self.abs_target(self.src[:-4]+"_"+os.path.basename(self.mtl[:-4])+".obj"), "w") as mtlfile:
+					mtlfile.write(file)
+				bpy.ops.import_scene.obj(filepath=self.src[:-4]+"_"+os.path.basename(self.mtl[:-4])+".obj", axis_up="Y", axis_forward="-Z")
 			else:
 				bpy.ops.import_scene.obj(filepath=self.src, axis_up="Y", axis_forward="-Z")
-			bpy.ops.object.transform_apply(location = True, scale = True, rotation = True)
-			self.objects = [o for o in list(bpy.data.objects) if o not in objects]
-			obj = bpy.context.selected_objects[0]
-			obj.name = self.id
 		else:
-			newobj = []
-			for obj in self.objects:
-				bpy.ops.object.select_all(action='DESELECT')
-				bpy.ops.object.select_pattern(pattern=obj.name)
-				bpy.ops.object.duplicate(linked=True)
-				newobj.append(bpy.context.selected_objects[0])
-			self.objects = newobj
-
-		for obj in self.objects:
-			scale = s2v(tag.attrs.get("scale", "1 1 1"))
-			obj.scale = (scale[0], scale[2], scale[1])
-			obj.rotation_euler = get_rotation_euler(tag, obj)
-			location = s2p(tag.attrs.get("pos", "0 0 0"))
-			obj.location = location #translate(obj.location, location)
-		return list(self.objects)
+			bpy.ops.import_scene.obj(filepath=self.src, axis_up="Y", axis_forward="-Z")
+		bpy.ops.object.transform_apply(location = True, scale = True, rotation = True)
+		return tracker.new_objects()
+
+def place(objects, tag):
+	scale = s2v(tag.attrs.get("scale", "1 1 1"))
+	scale = (scale[0], scale[2], scale[1])
+	rotation = get_rotation_euler(tag)
+	location = s2p(tag.attrs.get("pos", "0 0 0"))
+	for obj in objects:
+		obj.rotation_mode = 'XYZ'
+		obj.scale = scale
+		obj.rotation_euler = rotation
+		obj.location = location
+
+# Unit cube empty standing in for an object whose geometry isn't there yet
+def make_placeholder(tag):
+	empty = bpy.data.objects.new("placeholder_"+tag.get("id", ""), None)
+	if bpy.app.version < (2, 80):
+		empty.empty_draw_type = 'CUBE'
+		empty.empty_draw_size = 0.5
+	else:
+		empty.empty_display_type = 'CUBE'
+		empty.empty_display_size = 0.5
+	place([empty], tag)
+	return empty
+
+# assets of lazily imported rooms, kept so loading more placeholders reuses them
+lazy_assets = {}
+
+# Placeholder for lazy imports. It keeps the object and asset attributes, so the
+# geometry can be loaded later and the exporter can write the object back without it.
+def make_proxy(tag, basepath, asset_attrs=None):
+	empty = make_placeholder(tag)
+	empty.name = tag.get("id", "")
+	empty["janus_basepath"] = basepath
+	empty["janus_object"] = json.dumps(tag.attrs)
+	if asset_attrs is not None:
+		empty["janus_asset"] = json.dumps(asset_attrs)
+	empty["janus_placement"] = list(empty.location) + list(empty.rotation_euler) + list(empty.scale)
+	return empty
+
+def proxy_asset(proxy, workingpath):
+	basepath = proxy["janus_basepath"]
+	id = json.loads(proxy["janus_object"]).get("id", "")
+	asset = lazy_assets.get((basepath, id))
+	if asset is None:
+		if "janus_asset" in proxy:
+			asset = make_asset(basepath, workingpath, firebox.Element("assetobject", json.loads(proxy["janus_asset"])))
+		else:
+			asset = implicit_asset(basepath, workingpath, id)
+		if asset is not None:
+			lazy_assets[(basepath, id)] = asset
+	return asset
+
+# Swaps placeholders from a lazy import for their geometry, keeping where they were moved to
+def load_proxies(operator, proxies, workingpath):
+	tracker.reset()
+	progress.reset()
+	groups = {}
+	for proxy in proxies:
+		asset = proxy_asset(proxy, workingpath)
+		if asset is None:
+			operator.report({"WARNING"}, "No importable asset for %s" % proxy.name)
+			continue
+		# assets are kept across lazy loads, each load cancels on its own
+		asset.cancelled = progress.cancelled
+		groups.setdefault(id(asset), (asset, []))[1].append(proxy)
+	loaded = 0
+	for asset, group in groups.values():
+		try:
+			asset.load()
+			instances = asset.instantiate_many([firebox.Element("object", json.loads(proxy["janus_object"])) for proxy in group])
+		except:
+			print(traceback.format_exc())
+			continue
+		for proxy, objects in zip(group, instances):
+			for obj in objects:
+				obj.location = proxy.location
+				obj.rotation_euler = proxy.rotation_euler
+				obj.scale = proxy.scale
+			tracker.remove(proxy)
+			loaded += 1
+	operator.report({"INFO"}, "Loaded geometry for %d of %d placeholders" % (loaded, len(proxies)))
+
+def distance(a, b):
+	return ((a[0]-b[0])**2 + (a[1]-b[1])**2 + (a[2]-b[2])**2) ** 0.5
+
+def proximity(tag, origin):
+	d = distance(s2p(tag.attrs.get("pos", "0 0 0")), origin)
+	return (int(d // proximity_band), d)
+
+# Thread pool that runs the most urgent job first. Submitting a known key again
+# with a more urgent priority moves it up the queue if it hasn't started yet.
+class PriorityPool:
+	def __init__(self, workers):
+		self.heap = []
+		self.futures = {}
+		self.priorities = {}
+		self.order = itertools.count()
+		self.condition = threading.Condition()
+		self.closed = False
+		for i in range(workers):
+			threading.Thread(target=self.work, daemon=True).start()
+
+	def submit(self, key, fn, priority):
+		with self.condition:
+			future = self.futures.get(key)
+			if future is None:
+				future = self.futures[key] = Future()
+			elif future.running() or future.done() or priority >= self.priorities[key]:
+				return future
+			self.priorities[key] = priority
+			heapq.heappush(self.heap, (priority, next(self.order), key, fn))
+			self.condition.notify()
+			return future
+
+	def work(self):
+		while True:
+			with self.condition:
+				while not self.heap and not self.closed:
+					self.condition.wait()
+				if not self.heap:
+					return
+				priority, _, key, fn = heapq.heappop(self.heap)
+				future = self.futures[key]
+				# entries left behind by a priority change
+				if priority != self.priorities[key] or future.running() or future.done():
+					continue
+				if not future.set_running_or_notify_cancel():
+					continue
+			try:
+				future.set_result(fn())
+			except BaseException as e:
+				future.set_exception(e)
+
+	def cancel_pending(self):
+		with self.condition:
+			for future in self.futures.values():
+				future.cancel()
+			self.heap = []
+
+	def shutdown(self):
+		with self.condition:
+			self.closed = True
+			self.condition.notify_all()
 
 def get_rotation_euler(tag, obj=None):
 	if obj:
@@ -246,41 +683,33 @@ def get_rotation_euler(tag, obj=None):
 	else:
 		return fromFwd(s2v(tag.attrs.get("fwd", "0 0 1"))).to_euler()
 
-def read_html(operator, scene, filepath, path_mode, workingpath):
-	#FEATURE import from ipfs://
-	if filepath.startswith("http://") or filepath.startswith("https://"):
-		splitindex = filepath.rfind("/")
-		basepath = filepath[:splitindex+1]
-		basename = filepath[splitindex+1:]
-	else:
-		basepath = "file:///" + os.path.dirname(filepath)
-		basename = os.path.basename(filepath)
-		filepath = "file:///" + filepath
-
-	source = urlreq.urlopen(filepath.replace('\\','/'))
-	html = source.read()
-	#fireboxrooms = bs4.BeautifulSoup(html, "html.parser").findAll("fireboxroom")
-	fireboxrooms = bs4.BeautifulSoup(html, "html.parser").find_all(lambda tag: tag.name.lower()=='fireboxroom')
-	if len(fireboxrooms) == 0:
-		# no fireboxroom, remove comments and try again
-		html = re.sub("(<!--)", "", html.decode('utf-8'), flags=re.DOTALL).encode('utf-8')
-		html = re.sub("(-->)", "", html.decode('utf-8'), flags=re.DOTALL).encode('utf-8')
-	soup = bs4.BeautifulSoup(html, "html.parser")
-	fireboxrooms = soup.findAll("fireboxroom")
-
-	if len(fireboxrooms) == 0:
-		operator.report({"ERROR"}, "Could not find the FireBoxRoom tag")
-		return
-
-	fireboxroom = fireboxrooms[0]
+# Creates the asset for an <AssetObject> tag, None for formats that can't be imported
+def make_asset(basepath, workingpath, tag):
+	#dae might be different!
+	#assets with same basename will conflict (e.g. from different domains)
+	src = tag.attrs.get("src", None)
+	if src is None or tag.attrs.get("id", None) is None:
+		return None
+	src = src.lower()
+	if src.endswith(".obj") or src.endswith(".obj.gz"):
+		return AssetObjectObj(basepath, workingpath, tag)
+	elif src.endswith(".dae") or src.endswith(".dae.gz"):
+		return AssetObjectDae(basepath, workingpath, tag)
+	elif src.endswith(".gltf") or src.endswith(".gltf.gz") or src.endswith(".glb") or src.endswith(".glb.gz") or '://content.decentraland.today/contents/' in src:
+		return AssetObjectGltf(basepath, workingpath, tag)
+	elif src.endswith(".fbx") or src.endswith(".fbx.gz"):
+		return AssetObjectFbx(basepath, workingpath, tag)
+	return None
 
-	rooms = fireboxroom.findAll("room")
-	if rooms is None:
-		operator.report({"ERROR"}, "Could not find the Room tag")
-		return
-
-	room = rooms[0]
+# Asset for an <Object> id no <AssetObject> declared: primitives and direct model urls
+def implicit_asset(basepath, workingpath, id):
+	if id in primitives:
+		return AssetObjectPrimitive(basepath, workingpath, asset_tag(id, urls.resolve(primitive_path, id+'.obj')))
+	elif id.startswith('http://') or id.startswith('https://'):
+		return AssetObjectGltf(basepath, workingpath, asset_tag(id, id))
+	return None
 
+def set_room_properties(scene, room):
 	# Reset all changes in case of later error? Undo operator?
 	# Prevent having to specify defaults twice? (on external load and addon startup)
 	scene.janus_room_gravity = float(room.attrs.get("gravity", 9.8))
@@ -300,90 +729,217 @@ def read_html(operator, scene, filepath, path_mode, workingpath):
 	scene.janus_room_fog_col = s2v(room.attrs.get("fog_col", "100 100 100"))
 	scene.janus_room_locked = bool(room.attrs.get("locked", False))
 
+# The import as a sequence of short main-thread steps. Reading the page and the
+# downloads run in worker threads, while a step has to wait for one of them its
+# future is yielded. Closing the generator cancels the import, objects that were
+# already built stay and the placeholders of the others are removed.
+def import_steps(operator, scene, filepath, workingpath):
+	tracker.reset()
+	progress.reset()
+	cancelled = progress.cancelled
+	urls.reset()
+	#FEATURE import from ipfs://
+	if filepath.startswith("http://") or filepath.startswith("https://") or filepath.startswith("file:"):
+		filepath = urls.canonical(filepath)
+	else:
+		filepath = urls.file_url(filepath)
+	basepath = urls.directory(filepath)
+
+	# the origin is the room's spawn point unless the 3D cursor was chosen
+	origin = None
+	if scene.janus_import_origin == "cursor":
+		origin = tuple(scene.cursor_location if bpy.app.version < (2, 80) else scene.cursor.location)
+	radius = scene.janus_import_radius
+	lazy = scene.janus_import_lazy
+
+	room = None
 	jassets = {}
+	declared = {}
+	objects = []
+	nearest = {}
+	placeholders = {}
+	downloads = PriorityPool(fetch_workers)
 
-	assets = fireboxroom.findAll("assets")
-	if assets is None:
-		operator.report({"INFO"}, "No assets found")
-		return
+	# downloads an asset as soon as an object using it has been read, nearest first
+	def use_asset(id, priority):
+		if id not in jassets:
+			asset = implicit_asset(basepath, workingpath, id)
+			if asset is None:
+				# might still be declared further down
+				return
+			jassets[id] = asset
+		if id not in nearest or priority < nearest[id]:
+			nearest[id] = priority
+		if not lazy:
+			downloads.submit(id, jassets[id].load, priority)
 
-	all_assets = assets[0].findAll("assetobject")
-	for primitive_id in primitives:
-		asset_src = '<AssetObject id="'+primitive_id+'" src="'+os.path.join(primitive_path, primitive_id+'.obj')+'"/>'
-		asset = bs4.BeautifulSoup(asset_src, 'html.parser').find()
-		all_assets.append(asset)
-	for asset in all_assets:
-		#dae might be different!
-		#assets with same basename will conflict (e.g. from different domains)
-		
-		if asset.attrs.get("src", None) is not None:
-			if asset["src"].lower().endswith(".obj") or asset["src"].lower().endswith(".obj.gz"):
-				jassets[asset["id"]] = AssetObjectObj(basepath, workingpath, asset)
-			elif asset["src"].lower().endswith(".dae") or asset["src"].lower().endswith(".dae.gz"):
-				jassets[asset["id"]] = AssetObjectDae(basepath, workingpath, asset)
-			elif asset["src"].lower().endswith(".gltf") or asset["src"].lower().endswith(".gltf.gz") or asset["src"].lower().endswith(".glb") or asset["src"].lower().endswith(".glb.gz") or '://content.decentraland.today/contents/' in asset["src"].lower():
-				jassets[asset["id"]] = AssetObjectGltf(basepath, workingpath, asset)
-			elif asset["src"].lower().endswith(".fbx") or asset["src"].lower().endswith(".fbx.gz"):
-				jassets[asset["id"]] = AssetObjectFbx(basepath, workingpath, asset)
-			else:
-				continue
-		else:
-			continue
+	# runs in the reading thread
+	def on_element(element):
+		nonlocal room, origin
+		if cancelled.is_set():
+			raise ImportCancelled()
+		if element.name == "room":
+			if room is None:
+				room = element
+				if origin is None:
+					origin = s2p(room.attrs.get("pos", "0 0 0"))
+		elif element.name == "assetobject" and element.parent == "assets":
+			if element.get("id"):
+				declared[element["id"]] = element.attrs
+			asset = make_asset(basepath, workingpath, element)
+			if asset:
+				jassets[asset.id] = asset
+		elif element.name == "object" and element.parent == "room":
+			priority = proximity(element, origin or (0, 0, 0))
+			if radius > 0 and priority[1] > radius:
+				return
+			objects.append(element)
+			if element.get('id'):
+				use_asset(element['id'], priority)
 
-	objects = room.findAll("object")
-	if objects is None:
-		operator.report({"INFO"}, "No objects found")
-		return
+	def read_page():
+		read_start = time.perf_counter()
+		reader = firebox.read_url(filepath, on_element, os.path.join(workingpath, room_cache_dir), page_timeout)
+		return reader, time.perf_counter() - read_start
 
-	for obj in objects:
-		try:
+	try:
+		reading = run_in_thread(read_page)
+		while not reading.done():
+			yield reading
+		reader, read_time = reading.result()
+
+		if not reader.started:
+			operator.report({"ERROR"}, "Could not find the FireBoxRoom tag")
+			return
+		if room is None:
+			operator.report({"ERROR"}, "Could not find the Room tag")
+			return
+
+		set_room_properties(scene, room)
+
+		operator.report({"INFO"}, "Read FireBoxRoom%s in %.3fs: %d elements, %d assets, %d objects" % (" from cache" if reader.cached else "", read_time, reader.count, len(jassets), len(objects)))
+		if not objects:
+			operator.report({"INFO"}, "No objects found")
+			return
+
+		if lazy:
+			progress.stage = "Creating placeholders"
+			proxies = []
+			for obj in objects:
+				id = obj.get('id')
+				if id:
+					use_asset(id, proximity(obj, origin))
+				if id in jassets:
+					lazy_assets[(basepath, id)] = jassets[id]
+				# objects without an importable asset still get one, so they survive a re-export
+				proxies.append(make_proxy(obj, basepath, declared.get(id)))
+				yield
+			link_objects(proxies)
+			operator.report({"INFO"}, "Created %d placeholders, load their geometry from the Import Settings" % len(proxies))
+			return
+
+		# group the tags per asset so repeated objects become one batch of linked copies
+		instances = {}
+		for obj in objects:
 			id = obj.get('id')
 			if id:
-				asset = jassets.get(id)
-				if asset:
-					asset.instantiate(obj)
-				elif id.startswith('http://') or id.startswith('https://'):
-					asset_src = '<AssetObject id="'+id+'" src="'+id+'"/>'
-					new_asset = bs4.BeautifulSoup(asset_src, 'html.parser').find('assetobject')
-					jassets[new_asset['id']] = AssetObjectGltf(basepath, workingpath, new_asset)
-					asset = jassets.get(id)
-					asset.instantiate(obj)
-		except:
-			print(traceback.format_exc())
+				use_asset(id, proximity(obj, origin))
+				if id in jassets:
+					instances.setdefault(id, []).append(obj)
+		progress.assets = len(instances)
+
+		if scene.janus_import_placeholders:
+			progress.stage = "Creating placeholders"
+			for id, tags in instances.items():
+				placeholders[id] = [make_placeholder(tag) for tag in tags]
+				link_objects(placeholders[id])
+				yield
+
+		# band by band, nearest first, small assets first within a band
+		bands = {}
+		for id in instances:
+			bands.setdefault(nearest[id][0], []).append(id)
+		for band in sorted(bands):
+			ids = bands[band]
+			progress.stage = "Downloading"
+			for id in ids:
+				future = downloads.futures[id]
+				while not future.done():
+					yield future
+				try:
+					future.result()
+				except:
+					print(traceback.format_exc())
+			progress.stage = "Parsing"
+			parsing = run_in_thread(preparse_obj_assets, [jassets[id] for id in ids if type(jassets[id]) is AssetObjectObj])
+			while not parsing.done():
+				yield parsing
+			ids.sort(key=lambda id: (jassets[id].size(), nearest[id][1]))
+			progress.stage = "Building"
+			for id in ids:
+				try:
+					jassets[id].instantiate_many(instances[id])
+				except:
+					print(traceback.format_exc())
+				for empty in placeholders.pop(id, []):
+					tracker.remove(empty)
+				progress.asset_done()
+				yield
+	except GeneratorExit:
+		cancelled.set()
+		raise
+	finally:
+		downloads.cancel_pending()
+		downloads.shutdown()
+		for empties in placeholders.values():
+			for empty in empties:
+				tracker.remove(empty)
+
+def read_html(operator, scene, filepath, path_mode, workingpath):
+	# blocking, waits on the workers instead of polling them
+	steps.run_all(import_steps(operator, scene, filepath, workingpath))
 
 def translate(vec1, vec2):
 	return (vec1[0]+vec2[0], vec1[1]+vec2[1], vec1[2]+vec2[2])
 def multiply(vec1, vec2):
 	return (vec1[0]*vec2[0], vec1[1]*vec2[1], vec1[2]*vec2[2])
 
+# Built-in primitives, parsed once into the working path and shared as one mesh per session
+class AssetObjectPrimitive(AssetObjectObj):
+	def load(self):
+		if self.loaded:
+			return
+		self.src, _ = self.retrieve(self.src)
+		if native_obj_import and bpy.app.version >= (2, 80):
+			self.parsed = wavefront.cached_parse(self.src, os.path.join(self.workingpath, "primitives"))
+		self.loaded = True
+
+	def import_native(self):
+		name = "firevr_"+self.id
+		mesh = bpy.data.meshes.get(name)
+		if mesh is None or mesh.get("firevr_primitive") != self.id:
+			parsed = self.parsed
+			if parsed is None:
+				parsed = wavefront.cached_parse(self.src, os.path.join(self.workingpath, "primitives"))
+			mesh = build_mesh(parsed["groups"][0], {})
+			mesh.name = name
+			mesh["firevr_primitive"] = self.id
+		self.parsed = None
+		obj = bpy.data.objects.new(self.id, mesh)
+		link_objects([obj])
+		return [obj]
+
 class AssetObjectDae(AssetObjectObj):
-	def instantiate(self, tag):
-		self.load()
-		if not self.imported:
-			before = len(bpy.data.objects)
-			self.imported = True
-			bpy.ops.object.select_all(action='DESELECT')
-			bpy.ops.wm.collada_import(filepath=self.src)
-			bpy.ops.object.make_single_user(type='SELECTED_OBJECTS', object=True, obdata=True)
-			bpy.ops.object.transform_apply(location = True, scale = True, rotation = True)
-			self.objects = bpy.context.selected_objects
-			for obj in self.objects:
-				obj.name = self.id
-		else:
-			newobj = []
-			for obj in self.objects:
-				bpy.ops.object.select_all(action='DESELECT')
-				bpy.ops.object.select_pattern(pattern=obj.name)
-				bpy.ops.object.duplicate(linked=True)
-				newobj.extend(bpy.context.selected_objects)
-			self.objects = newobj
-
-		for obj in self.objects:
-			scale = s2v(tag.attrs.get("scale", "1 1 1"))
-			obj.scale = (scale[0], scale[2], scale[1])
-			obj.rotation_euler = get_rotation_euler(tag, obj)
-			location = s2p(tag.attrs.get("pos", "0 0 0"))
-			obj.location = location
+	def import_asset(self):
+		bpy.ops.object.select_all(action='DESELECT')
+		tracker.begin()
+		bpy.ops.wm.collada_import(filepath=self.src)
+		bpy.ops.object.make_single_user(type='SELECTED_OBJECTS', object=True, obdata=True)
+		bpy.ops.object.transform_apply(location = True, scale = True, rotation = True)
+		objects = tracker.new_objects()
+		for obj in objects:
+			obj.name = self.id
+		return objects
 
 	def load(self):
 
@@ -422,57 +978,30 @@ class AssetObjectDae(AssetObjectObj):
 		f.close()
 
 class AssetObjectGltf(AssetObjectObj):
-	def instantiate(self, tag):
-		self.load()
-		if not self.imported:
-			before = len(bpy.data.objects)
-			self.imported = True
-			bpy.ops.object.select_all(action='DESELECT')
-			objects = list(bpy.data.objects)
-			try:
-				bpy.ops.import_scene.gltf(filepath=self.src)
-			except Exception as e:
-				print(traceback.format_exc())
-			bpy.ops.object.make_single_user(type='SELECTED_OBJECTS', object=True, obdata=True)
-			bpy.ops.object.transform_apply(location = True, scale = True, rotation = True)
-			self.objects = [o for o in list(bpy.data.objects) if o not in objects]
-			#bpy.context.selected_objects = self.objects
-			for obj in self.objects:
-				obj.select_set(state=True)
-			bpy.ops.object.join()
-			bpy.ops.object.select_all(action='DESELECT')
-			self.objects = [o for o in list(bpy.data.objects) if o not in objects]
-			for obj in self.objects:
-				obj.select_set(state=True)
-				obj.name = self.id
-		else:
-			newobj = []
-			bpy.ops.object.select_all(action='DESELECT')
-			for obj in self.objects:
-				#bpy.ops.object.select_pattern(pattern=obj.name)
-				obj.select_set(state=True)
-			bpy.ops.object.duplicate(linked=True)
-			newobj.extend(bpy.context.selected_objects)
-			self.objects = newobj
-
-		for obj in self.objects:
-			scale = s2v(tag.attrs.get("scale", "1 1 1"))
-			obj.scale = (scale[0], scale[2], scale[1])
-			obj.rotation_euler = get_rotation_euler(tag, obj)
-			
-			'''
-			if "xdir" in tag.attrs or "ydir" in tag.attrs or "zdir" in tag.attrs:
-				xdir = s2v(tag.attrs.get("xdir", "1 0 0"))
-				ydir = s2v(tag.attrs.get("ydir", "0 1 0"))
-				zdir = s2v(tag.attrs.get("zdir", "0 0 1"))
-				zdir = (zdir[0], zdir[2], zdir[1])
-				ydir = (ydir[0], ydir[2], ydir[1])
-				obj.rotation_mode = 'XYZ'
-				obj.rotation_euler = (Matrix([xdir, zdir, ydir])).to_euler()
-			else:
-				obj.rotation_euler = fromFwd(s2v(tag.attrs.get("fwd", "0 0 1"))).to_euler()
-			'''
-			obj.location = s2p(tag.attrs.get("pos", "0 0 0"))
+	def import_asset(self):
+		bpy.ops.object.select_all(action='DESELECT')
+		tracker.begin()
+		try:
+			bpy.ops.import_scene.gltf(filepath=self.src)
+		except Exception as e:
+			print(traceback.format_exc())
+		new_objects = tracker.new_objects()
+		if not new_objects:
+			return []
+		bpy.ops.object.make_single_user(type='SELECTED_OBJECTS', object=True, obdata=True)
+		bpy.ops.object.transform_apply(location = True, scale = True, rotation = True)
+		pointers = [o.as_pointer() for o in new_objects]
+		for obj in new_objects:
+			obj.select_set(state=True)
+		bpy.ops.object.join()
+		new_objects = list(bpy.context.selected_objects)
+		tracker.joined(pointers, new_objects)
+		bpy.ops.object.select_all(action='DESELECT')
+		for obj in new_objects:
+			obj.select_set(state=True)
+			obj.name = self.id
+		return new_objects
+
 	def load(self):
 		if self.loaded:
 			return
@@ -485,82 +1014,62 @@ class AssetObjectGltf(AssetObjectObj):
 			self.loaded = True
 
 	def parse_gltf(self, path, gltf_url):
-		changed_file = False
-		content = None
-		with open(path, 'rb') as f:
-			try:
-				content = json.loads(str(f.read(), 'utf-8'))
-			except: # probably gltf binary, ignore
-				return
-			# fetch .bin
-			buffers = content.get('buffers',[])
-			for i in range(0,len(buffers)):
-				buffer = buffers[i]
-				uri = buffer.get('uri',None)
-				if uri:
-					if uri.startswith('data:'):
-						continue
-					uri_fn = self.abs_source(os.path.dirname(gltf_url), uri)
-					if not os.path.exists(os.path.join(self.workingpath, uri_fn)):
-						bin, _ = self.retrieve(uri_fn, os.path.dirname(self.abs_source(os.path.dirname(gltf_url), uri_fn)))
-						content['buffers'][i]['uri'] = bin
-						changed_file = True
-			# fetch images
-			images = content.get('images',[])
-			for i in range(0,len(images)):
-				image = images[i]
-				uri = image.get('uri',None)
-				if uri:
-					if uri.startswith('data:'):
-						continue
-					uri_fn = self.abs_source(os.path.dirname(gltf_url), uri)
-					if not os.path.exists(os.path.join(self.workingpath, uri_fn)):
-						img, _ = self.retrieve(uri_fn, os.path.dirname(self.abs_source(os.path.dirname(gltf_url), uri_fn)))
-						content['images'][i]['uri'] = img
-						changed_file = True
-		if changed_file:
-			with open(path, 'wb') as f:
-				f.write(bytes(json.dumps(content), 'utf-8'))
+		glb = None
+		try:
+			if gltf.is_glb(path):
+				# only the JSON chunk is read, the BIN chunk stays mapped
+				glb = gltf.GlbFile(path)
+				content = glb.content
+			else:
+				with open(path, 'rb') as f:
+					content = json.load(f)
+		except ValueError:
+			print('Could not parse glTF '+path)
+			return
+		try:
+			# fetch .bin buffers and images
+			dependencies = list(gltf.external_uris(content))
+			sources = [self.abs_source(os.path.dirname(gltf_url), uri) for _, _, uri in dependencies]
+			retrieved = self.retrieve_all(sources, os.path.dirname(gltf_url))
+			changed_file = False
+			for (section, i, _), (local, _) in zip(dependencies, retrieved):
+				if local:
+					content[section][i]['uri'] = local
+					changed_file = True
+			if changed_file:
+				if glb:
+					glb.save(content)
+				else:
+					with open(path, 'wb') as f:
+						f.write(bytes(json.dumps(content), 'utf-8'))
+		finally:
+			if glb:
+				glb.close()
 	
 class AssetObjectFbx(AssetObjectObj):
-	def instantiate(self, tag):
-		self.load()
-		if not self.imported:
-			before = len(bpy.data.objects)
-			self.imported = True
-			bpy.ops.object.select_all(action='DESELECT')
-			objects = list(bpy.data.objects)
-			bpy.ops.import_scene.fbx(filepath=self.src, bake_space_transform=True, global_scale=100.0, use_manual_orientation=False, axis_up='Z', axis_forward='-Y')#, axis_up='Y', axis_forward='-Z')
-			bpy.ops.object.make_single_user(type='SELECTED_OBJECTS', object=True, obdata=True)
-			bpy.ops.object.transform_apply(location = True, scale = True, rotation = True)
-			self.objects = [o for o in list(bpy.data.objects) if o not in objects]
-			for obj in self.objects:
-				obj.select_set(state=True)
-				bpy.context.view_layer.objects.active = obj
-			bpy.ops.object.join()
-			bpy.ops.object.select_all(action='DESELECT')
-			self.objects = [o for o in list(bpy.data.objects) if o not in objects]
-			for obj in self.objects:
-				obj.select_set(state=True)
-				obj.name = self.id
-				bpy.context.view_layer.objects.active = obj
-		else:
-			newobj = []
-			for obj in self.objects:
-				bpy.ops.object.select_all(action='DESELECT')
-				bpy.ops.object.select_pattern(pattern=obj.name)
-				bpy.ops.object.duplicate(linked=True)
-				newobj.extend(bpy.context.selected_objects)
-			self.objects = newobj
-
-		for obj in self.objects:
-			scale = s2v(tag.attrs.get("scale", "1 1 1"))
-			obj.scale = (scale[0], scale[2], scale[1])
-			
-			obj.rotation_euler = get_rotation_euler(tag, obj)
-			
-
-			obj.location = s2p(tag.attrs.get("pos", "0 0 0"))
+	def import_asset(self):
+		bpy.ops.object.select_all(action='DESELECT')
+		tracker.begin()
+		bpy.ops.import_scene.fbx(filepath=self.src, bake_space_transform=True, global_scale=100.0, use_manual_orientation=False, axis_up='Z', axis_forward='-Y')#, axis_up='Y', axis_forward='-Z')
+		new_objects = tracker.new_objects()
+		if not new_objects:
+			return []
+		bpy.ops.object.make_single_user(type='SELECTED_OBJECTS', object=True, obdata=True)
+		bpy.ops.object.transform_apply(location = True, scale = True, rotation = True)
+		pointers = [o.as_pointer() for o in new_objects]
+		for obj in new_objects:
+			obj.select_set(state=True)
+			bpy.context.view_layer.objects.active = obj
+		bpy.ops.object.join()
+		new_objects = list(bpy.context.selected_objects)
+		tracker.joined(pointers, new_objects)
+		bpy.ops.object.select_all(action='DESELECT')
+		for obj in new_objects:
+			obj.select_set(state=True)
+			obj.name = self.id
+			bpy.context.view_layer.objects.active = obj
+		return new_objects
+
 	def load(self):
 		if self.loaded:
 			return
@@ -0,0 +1,249 @@
+# Wavefront .obj/.mtl parsing into NumPy arrays, no bpy in here so it can run in worker threads
+import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+# files are only parsed in worker threads if there are at least this many
+parallel_threshold = 4
+
+def floats(lines, width):
+	if not lines:
+		return np.zeros((0, width), dtype=np.float32)
+	rows = [line.split() for line in lines]
+	counts = set(len(row) for row in rows)
+	if len(counts) == 1:
+		count = counts.pop()
+		if count >= width:
+			values = np.array(b' '.join(lines).split(), dtype=np.float32)
+			return values.reshape(-1, count)[:, :width]
+	# uneven rows (e.g. vertex colors on some lines only), pad and cut row by row
+	out = np.zeros((len(rows), width), dtype=np.float32)
+	for i, row in enumerate(rows):
+		row = row[:width]
+		out[i, :len(row)] = [float(c) for c in row]
+	return out
+
+# Splits face corners ("v", "v/vt", "v//vn", "v/vt/vn") into vertex, uv and normal
+# index columns, 0 where a corner has none
+def corners(tokens):
+	if not tokens:
+		empty = np.zeros(0, dtype=np.int64)
+		return empty, empty, empty
+	slashes = set(token.count(b'/') for token in tokens)
+	if len(slashes) == 1:
+		joined = b' '.join(tokens).replace(b'//', b'/0/')
+		width = slashes.pop() + 1
+		values = np.array(joined.replace(b'/', b' ').split(), dtype=np.int64).reshape(-1, width)
+		v = values[:, 0]
+		vt = values[:, 1] if width > 1 else np.zeros(len(v), dtype=np.int64)
+		vn = values[:, 2] if width > 2 else np.zeros(len(v), dtype=np.int64)
+		return v, vt, vn
+	v = np.empty(len(tokens), dtype=np.int64)
+	vt = np.zeros(len(tokens), dtype=np.int64)
+	vn = np.zeros(len(tokens), dtype=np.int64)
+	for i, token in enumerate(tokens):
+		parts = token.split(b'/')
+		v[i] = int(parts[0])
+		if len(parts) > 1 and parts[1]:
+			vt[i] = int(parts[1])
+		if len(parts) > 2 and parts[2]:
+			vn[i] = int(parts[2])
+	return v, vt, vn
+
+# OBJ indices are 1-based, negative ones count back from the elements defined so far
+def resolve(index, defined):
+	return np.where(index < 0, defined + index, index - 1)
+
+class ObjGroup:
+	def __init__(self, name):
+		self.name = name
+		self.materials = []
+		self.tokens = []
+		self.face_sizes = []
+		self.face_materials = []
+		self.face_smooth = []
+		self.v_defined = []
+		self.vt_defined = []
+		self.vn_defined = []
+
+	def material(self, name):
+		if name not in self.materials:
+			self.materials.append(name)
+		return self.materials.index(name)
+
+	# turn the collected text into arrays, returns a plain picklable dict
+	def finish(self, positions, uvs, normals):
+		sizes = np.array(self.face_sizes, dtype=np.int64)
+		v, vt, vn = corners(self.tokens)
+		v = resolve(v, np.repeat(np.array(self.v_defined, dtype=np.int64), sizes))
+		used, v = np.unique(v, return_inverse=True)
+		group = {
+			"name": self.name,
+			"positions": positions[used],
+			"loop_vertices": v.astype(np.int32),
+			"face_sizes": sizes.astype(np.int32),
+			"face_starts": (np.cumsum(sizes) - sizes).astype(np.int32),
+			"face_materials": np.array(self.face_materials, dtype=np.int32),
+			"face_smooth": np.array(self.face_smooth, dtype=bool),
+			"materials": self.materials,
+			"loop_uvs": None,
+			"loop_normals": None,
+		}
+		if len(uvs) and np.all(vt != 0):
+			vt = resolve(vt, np.repeat(np.array(self.vt_defined, dtype=np.int64), sizes))
+			group["loop_uvs"] = uvs[vt]
+		# custom split normals, only if every corner has one like the bpy importer expects
+		if len(normals) and np.all(vn != 0):
+			vn = resolve(vn, np.repeat(np.array(self.vn_defined, dtype=np.int64), sizes))
+			group["loop_normals"] = normals[vn]
+		return group
+
+def parse_obj(path, z_up=True):
+	v_lines = []
+	vt_lines = []
+	vn_lines = []
+	mtllibs = []
+	groups = []
+	group = None
+	material = None
+	smooth = False
+	with open(path, 'rb') as f:
+		for line in f:
+			words = line.split(None, 1)
+			if len(words) < 2:
+				continue
+			key, rest = words
+			if key == b'v':
+				v_lines.append(rest)
+			elif key == b'vt':
+				vt_lines.append(rest)
+			elif key == b'vn':
+				vn_lines.append(rest)
+			elif key == b'f':
+				if group is None:
+					group = ObjGroup(os.path.splitext(os.path.basename(path))[0])
+					groups.append(group)
+				tokens = rest.split()
+				group.tokens.extend(tokens)
+				group.face_sizes.append(len(tokens))
+				group.face_materials.append(group.material(material))
+				group.face_smooth.append(smooth)
+				group.v_defined.append(len(v_lines))
+				group.vt_defined.append(len(vt_lines))
+				group.vn_defined.append(len(vn_lines))
+			elif key == b'o':
+				group = ObjGroup(rest.strip().decode('utf-8', 'replace'))
+				groups.append(group)
+			elif key == b'usemtl':
+				material = rest.strip().decode('utf-8', 'replace')
+			elif key == b's':
+				smooth = rest.strip() not in (b'off', b'0')
+			elif key == b'mtllib':
+				mtllibs.append(rest.strip().decode('utf-8', 'replace'))
+	positions = floats(v_lines, 3)
+	normals = floats(vn_lines, 3)
+	if z_up:
+		# Y up, -Z forward to Blender's Z up
+		positions = np.stack((positions[:, 0], -positions[:, 2], positions[:, 1]), axis=1)
+		normals = np.stack((normals[:, 0], -normals[:, 2], normals[:, 1]), axis=1)
+	uvs = floats(vt_lines, 2)
+	return {
+		"path": path,
+		"mtllibs": mtllibs,
+		"groups": [g.finish(positions, uvs, normals) for g in groups if g.face_sizes],
+	}
+
+def parse_mtl(path):
+	materials = {}
+	material = None
+	with open(path, 'r', encoding='utf-8', errors='replace') as f:
+		for line in f:
+			words = line.split()
+			if not words:
+				continue
+			if words[0] == 'newmtl':
+				material = materials.setdefault(' '.join(words[1:]), {})
+			elif material is None:
+				continue
+			elif words[0] in ('Kd', 'Ks', 'Ka', 'Ke'):
+				try:
+					material[words[0]] = tuple(float(c) for c in words[1:4])
+				except ValueError:
+					pass
+			elif words[0] in ('d', 'Ns', 'Ni'):
+				try:
+					material[words[0]] = float(words[1])
+				except (ValueError, IndexError):
+					pass
+			elif words[0] == 'Tr':
+				try:
+					material['d'] = 1.0 - float(words[1])
+				except (ValueError, IndexError):
+					pass
+			elif words[0].startswith('map_') or words[0] in ('bump', 'disp'):
+				# options like -s 1 1 1 come first, the file name is last
+				material[words[0]] = words[-1]
+	return materials
+
+group_arrays = ("positions", "loop_vertices", "face_sizes", "face_starts", "face_materials", "face_smooth", "loop_uvs", "loop_normals")
+
+# Stores a parse_obj result as plain arrays, no pickling needed to read it back
+def save_npz(parsed, path):
+	arrays = {"mtllibs": np.array(parsed["mtllibs"], dtype=str), "names": np.array([g["name"] for g in parsed["groups"]], dtype=str)}
+	for i, group in enumerate(parsed["groups"]):
+		for key in group_arrays:
+			if group[key] is not None:
+				arrays["%d_%s" % (i, key)] = group[key]
+		arrays["%d_materials" % i] = np.array([m or "" for m in group["materials"]], dtype=str)
+	tmp_path = path+'.tmp.npz'
+	np.savez(tmp_path, **arrays)
+	os.replace(tmp_path, path)
+
+def load_npz(path):
+	with np.load(path) as data:
+		groups = []
+		for i, name in enumerate(data["names"]):
+			group = {"name": str(name)}
+			for key in group_arrays:
+				group[key] = data["%d_%s" % (i, key)] if "%d_%s" % (i, key) in data else None
+			group["materials"] = [str(m) or None for m in data["%d_materials" % i]]
+			groups.append(group)
+		return {"path": path, "mtllibs": [str(m) for m in data["mtllibs"]], "groups": groups}
+
+# parse_obj with the result kept in cache_dir, keyed by name, size and mtime of the .obj
+def cached_parse(path, cache_dir, z_up=True):
+	stat = os.stat(path)
+	name = os.path.splitext(os.path.basename(path))[0]
+	# _n: caches from before normals were kept lack them
+	cache = os.path.join(cache_dir, "%s_%d_%d%s_n.npz" % (name, stat.st_size, int(stat.st_mtime), "" if z_up else "_yup"))
+	if os.path.exists(cache):
+		try:
+			return load_npz(cache)
+		except (OSError, ValueError, KeyError) as e:
+			print('Ignoring broken cache', cache, e)
+	parsed = parse_obj(path, z_up)
+	try:
+		os.makedirs(cache_dir, exist_ok=True)
+		save_npz(parsed, cache)
+	except OSError as e:
+		print('Could not cache', path, e)
+	return parsed
+
+# for worker pools, a broken file only costs its own result
+def try_parse_obj(path, z_up=True):
+	try:
+		return parse_obj(path, z_up)
+	except Exception as e:
+		print('Could not parse', path, e)
+		return None
+
+# Parses many .obj files, in worker threads if there are enough of them. Threads and
+# not processes: this is called from the importer's own threads while downloads run,
+# and forking Blender there can leave the child stuck on a lock another thread held.
+# The NumPy conversions let go of the GIL, the line splitting doesn't.
+def parse_many(paths, z_up=True, workers=None):
+	if len(paths) < parallel_threshold:
+		return [try_parse_obj(path, z_up) for path in paths]
+	workers = min(workers or os.cpu_count() or 1, len(paths))
+	with ThreadPoolExecutor(max_workers=workers) as pool:
+		return list(pool.map(try_parse_obj, paths, [z_up]*len(paths)))